@@ -0,0 +1 @@
+"""Нагрузочные тесты rty.py на фейковых бэкендах."""
@@ -0,0 +1,529 @@
+"""Фейковые бэкенды Telegram, Яндекс.Музыки, VK и YouTube для нагрузочных тестов rty.py.
+
+install_fakes() подменяет модули telebot, yandex_music, vk_api и yt_dlp в sys.modules,
+поэтому его нужно вызвать до импорта rty. Задержки и доля ошибок задаются через Backend.
+"""
+import hashlib
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+import types as pytypes
+
+
+class FakeBackendError(Exception):
+    """Искусственная ошибка бэкенда"""
+
+
+class Backend:
+    """Модель сетевого бэкенда: задержка в мс с разбросом и вероятность ошибки"""
+
+    def __init__(self, name, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0):
+        self.name = name
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.calls = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def call(self, method):
+        with self._lock:
+            self.calls += 1
+            failed = random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+
+        delay = max(0.0, random.uniform(self.latency_ms - self.jitter_ms, self.latency_ms + self.jitter_ms))
+        if delay:
+            time.sleep(delay / 1000.0)
+        if failed:
+            raise FakeBackendError(f"{self.name}.{method}: искусственная ошибка")
+
+
+BACKENDS = {
+    'telegram': Backend('telegram'),
+    'yandex': Backend('yandex'),
+    'vk': Backend('vk'),
+    'youtube': Backend('youtube'),
+}
+
+
+def configure(name, latency_ms=None, jitter_ms=None, error_rate=None):
+    """Меняет параметры бэкенда на лету"""
+    backend = BACKENDS[name]
+    if latency_ms is not None:
+        backend.latency_ms = latency_ms
+    if jitter_ms is not None:
+        backend.jitter_ms = jitter_ms
+    if error_rate is not None:
+        backend.error_rate = error_rate
+
+
+def _stable_int(text, modulo=10 ** 8):
+    return int(hashlib.md5(str(text).encode('utf-8')).hexdigest()[:12], 16) % modulo
+
+
+# --- TELEGRAM ---
+class _Obj:
+    """Универсальный объект для типов telebot: хранит аргументы и кнопки"""
+
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.__dict__.update(kwargs)
+        self.keyboard = []
+
+    def add(self, *buttons, **kwargs):
+        self.keyboard.append(list(buttons))
+        return self
+
+    def row(self, *buttons):
+        return self.add(*buttons)
+
+    @classmethod
+    def de_json(cls, data):
+        return cls(**data) if isinstance(data, dict) else data
+
+
+class _TypesModule(pytypes.ModuleType):
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        cls = type(name, (_Obj,), {})
+        setattr(self, name, cls)
+        return cls
+
+
+class FakeChat:
+    def __init__(self, chat_id):
+        self.id = chat_id
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+class FakeAudio:
+    def __init__(self, file_id):
+        self.file_id = file_id
+
+
+class FakeMessage:
+    _ids = itertools.count(1)
+
+    def __init__(self, chat_id, text=None, audio=None):
+        self.message_id = next(self._ids)
+        self.chat = FakeChat(chat_id)
+        self.from_user = FakeUser(chat_id)
+        self.text = text
+        self.audio = audio
+
+
+class FakeCallbackQuery:
+    _ids = itertools.count(1)
+
+    def __init__(self, chat_id, data, message=None):
+        self.id = str(next(self._ids))
+        self.data = data
+        self.from_user = FakeUser(chat_id)
+        self.message = message or FakeMessage(chat_id)
+
+
+class FakeInlineQuery:
+    _ids = itertools.count(1)
+
+    def __init__(self, user_id, query, offset=''):
+        self.id = str(next(self._ids))
+        self.from_user = FakeUser(user_id)
+        self.query = query
+        self.offset = offset
+
+
+# Обработчики бота сами ловят исключения и отвечают «❌ ...», поэтому неуспех запроса
+# отмечается здесь, в потоке обработчика: ответ с ошибкой или сбой вызова Telegram
+request_state = threading.local()
+
+
+def reset_request_state():
+    request_state.failed = False
+
+
+def request_failed():
+    return getattr(request_state, 'failed', False)
+
+
+class FakeTeleBot:
+    """Минимальная замена telebot.TeleBot: регистрирует обработчики и имитирует вызовы API"""
+
+    def __init__(self, token=None, *args, **kwargs):
+        self.token = token
+        self.message_handlers = []
+        self.callback_query_handlers = []
+        self.inline_handlers = []
+        self.chosen_inline_handlers = []
+        self.sent = []
+        self._lock = threading.Lock()
+
+    # Регистрация обработчиков
+    def message_handler(self, commands=None, func=None, **kwargs):
+        def decorator(handler):
+            self.message_handlers.append((commands, func, handler))
+            return handler
+        return decorator
+
+    def callback_query_handler(self, func=None, **kwargs):
+        def decorator(handler):
+            self.callback_query_handlers.append((func, handler))
+            return handler
+        return decorator
+
+    def inline_handler(self, func=None, **kwargs):
+        def decorator(handler):
+            self.inline_handlers.append((func, handler))
+            return handler
+        return decorator
+
+    def chosen_inline_handler(self, func=None, **kwargs):
+        def decorator(handler):
+            self.chosen_inline_handlers.append((func, handler))
+            return handler
+        return decorator
+
+    # Диспетчеризация
+    def dispatch_message(self, message):
+        text = message.text or ''
+        command = text.split()[0][1:].split('@')[0] if text.startswith('/') else None
+        for commands, func, handler in self.message_handlers:
+            if commands and command not in commands:
+                continue
+            if func and not func(message):
+                continue
+            return handler(message)
+
+    def dispatch_callback(self, call):
+        for func, handler in self.callback_query_handlers:
+            if func is None or func(call):
+                return handler(call)
+
+    def dispatch_inline(self, inline_query):
+        for func, handler in self.inline_handlers:
+            if func is None or func(inline_query):
+                return handler(inline_query)
+
+    # Методы API
+    def _api(self, method, chat_id=None, text=None, **kwargs):
+        if text and '❌' in str(text):
+            request_state.failed = True
+        try:
+            BACKENDS['telegram'].call(method)
+        except FakeBackendError:
+            request_state.failed = True
+            raise
+        with self._lock:
+            self.sent.append(method)
+        return FakeMessage(chat_id)
+
+    def reply_to(self, message, text, **kwargs):
+        return self._api('sendMessage', message.chat.id, text)
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self._api('sendMessage', chat_id, text)
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        return self._api('editMessageText', chat_id, text)
+
+    def send_audio(self, chat_id, audio, **kwargs):
+        if hasattr(audio, 'read'):
+            audio.read()
+            file_id = f"file_{_stable_int(getattr(audio, 'name', id(audio)))}"
+        else:
+            file_id = str(audio)
+        message = self._api('sendAudio', chat_id)
+        message.audio = FakeAudio(file_id)
+        return message
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def method(*args, **kwargs):
+            text = kwargs.get('text') or next((arg for arg in args if isinstance(arg, str) and '❌' in arg), None)
+            return self._api(name, kwargs.get('chat_id'), text)
+        return method
+
+
+# --- ЯНДЕКС.МУЗЫКА ---
+class FakeUnauthorizedError(Exception):
+    pass
+
+
+class FakeNetworkError(Exception):
+    pass
+
+
+class FakeArtist:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeAlbum:
+    def __init__(self, album_id, title):
+        self.id = album_id
+        self.title = title
+
+
+class FakeDownloadInfo:
+    def __init__(self, track_id, codec, bitrate):
+        self.codec = codec
+        self.bitrate_in_kbps = bitrate
+        self.direct_link = None
+        self._track_id = track_id
+
+    def get_direct_link(self):
+        BACKENDS['yandex'].call('get_direct_link')
+        self.direct_link = f"https://fake-storage/{self._track_id}/{self.bitrate_in_kbps}.mp3"
+        return self.direct_link
+
+
+class FakeTrack:
+    def __init__(self, track_id, album_id, title, artist):
+        self.id = track_id
+        self.title = title
+        self.artists = [FakeArtist(artist)]
+        self.albums = [FakeAlbum(album_id, f"Альбом {album_id}")]
+        self.duration_ms = 180000 + track_id % 60000
+
+    def get_download_info(self, get_direct_links=False):
+        BACKENDS['yandex'].call('get_download_info')
+        return [FakeDownloadInfo(self.id, 'mp3', bitrate) for bitrate in (128, 192, 320)]
+
+
+class _SearchTracks:
+    def __init__(self, results):
+        self.results = results
+
+
+class _SearchResult:
+    def __init__(self, results):
+        self.tracks = _SearchTracks(results)
+
+
+class FakeYandexClient:
+    def __init__(self, token=None, *args, **kwargs):
+        self.token = token
+        self.me = _Obj(account_status=lambda: _Obj(account=_Obj(login='bench')))
+
+    def init(self):
+        BACKENDS['yandex'].call('init')
+        return self
+
+    def search(self, text, type_='all', page=0, **kwargs):
+        BACKENDS['yandex'].call('search')
+        base = _stable_int(text)
+        results = [FakeTrack(base + i, base // 7 + i, f"{text} #{i + 1}", f"Исполнитель {i % 5}")
+                   for i in range(20)]
+        return _SearchResult(results)
+
+    def tracks(self, track_ids, **kwargs):
+        BACKENDS['yandex'].call('tracks')
+        result = []
+        for key in track_ids:
+            track_id, _, album_id = str(key).partition(':')
+            result.append(FakeTrack(int(track_id), int(album_id or 0), f"Трек {track_id}", "Исполнитель"))
+        return result
+
+
+# --- VK ---
+class FakeVkApiError(Exception):
+    pass
+
+
+class FakeApiError(FakeVkApiError):
+    pass
+
+
+class FakeVkApi:
+    def __init__(self, *args, **kwargs):
+        self.kwargs = kwargs
+
+
+class FakeVkAudio:
+    def __init__(self, vk, *args, **kwargs):
+        self.vk = vk
+
+    def search(self, q=None, count=100, **kwargs):
+        BACKENDS['vk'].call('search')
+        base = _stable_int(q)
+        for i in range(count):
+            yield {
+                'id': base + i,
+                'owner_id': 1000 + i,
+                'title': f"{q} #{i + 1}",
+                'artist': f"VK исполнитель {i % 4}",
+                'duration': 200 + i,
+                'url': f"https://fake-vk/audio/{base + i}.mp3",
+            }
+
+
+# --- YOUTUBE ---
+class FakeDownloadCancelled(Exception):
+    pass
+
+
+class FakeDownloadError(Exception):
+    pass
+
+
+class FakeYoutubeDL:
+    payload_size = 256 * 1024
+
+    def __init__(self, params=None):
+        self.params = params or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def _info(self, query):
+        video_id = f"v{_stable_int(query)}"
+        return {'id': video_id, 'title': f"Видео {query}", 'uploader': 'Bench channel', 'duration': 240,
+                'ext': 'webm', 'webpage_url': f"https://www.youtube.com/watch?v={video_id}"}
+
+    def extract_info(self, query, download=True, **kwargs):
+        BACKENDS['youtube'].call('extract_info')
+        if str(query).startswith('ytsearch'):
+            count_part, _, text = str(query)[len('ytsearch'):].partition(':')
+            count = int(count_part or 1)
+            entries = [dict(self._info(f"{text}#{i}"), url=None) for i in range(count)]
+            info = {'_type': 'playlist', 'entries': entries}
+            if download:
+                for entry in entries[:1]:
+                    self._write(entry)
+            return info
+
+        info = self._info(query)
+        if download:
+            self._write(info)
+        return info
+
+    def process_ie_result(self, info, download=True, **kwargs):
+        BACKENDS['youtube'].call('process_ie_result')
+        if download:
+            self._write(info)
+        return info
+
+    def prepare_filename(self, info, **kwargs):
+        outtmpl = self.params.get('outtmpl', '%(id)s.%(ext)s')
+        if isinstance(outtmpl, dict):
+            outtmpl = outtmpl.get('default', '%(id)s.%(ext)s')
+        return outtmpl % info
+
+    def _write(self, info):
+        BACKENDS['youtube'].call('download')
+        path = os.path.splitext(self.prepare_filename(info))[0] + '.mp3'
+        for hook in self.params.get('progress_hooks', []):
+            hook({'status': 'downloading', 'downloaded_bytes': 0, 'total_bytes': self.payload_size})
+        with open(path, 'wb') as f:
+            f.write(b'\0' * self.payload_size)
+        for hook in self.params.get('progress_hooks', []):
+            hook({'status': 'finished', 'downloaded_bytes': self.payload_size, 'total_bytes': self.payload_size})
+
+
+# --- HTTP (прямые ссылки на файлы) ---
+class FakeResponse:
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+        self.headers = {'Content-Length': str(len(content)), 'Accept-Ranges': 'bytes'}
+        self.text = content.decode('latin-1')
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise FakeBackendError(f"HTTP {self.status_code}")
+
+    def iter_content(self, chunk_size=65536):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeHttpSession:
+    """Отдаёт файлы по ссылкам фейковых бэкендов с задержкой соответствующего бэкенда"""
+    payload_size = 256 * 1024
+    hosts = {'fake-storage': 'yandex', 'fake-vk': 'vk', 'fake-youtube': 'youtube'}
+
+    def request(self, method, url, **kwargs):
+        host = url.split('/')[2] if '://' in url else url
+        BACKENDS[self.hosts.get(host, 'telegram')].call(f"http.{method.lower()}")
+        content = b'\0' * self.payload_size
+        range_header = (kwargs.get('headers') or {}).get('Range')
+        if range_header:
+            start, _, end = range_header.replace('bytes=', '').partition('-')
+            content = content[int(start):int(end) + 1 if end else None]
+            response = FakeResponse(content, 206)
+            response.headers['Content-Range'] = f"bytes {start}-{end}/{self.payload_size}"
+            return response
+        return FakeResponse(content)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        response = self.request('HEAD', url, **kwargs)
+        response.content = b''
+        return response
+
+
+def _module(name, **attrs):
+    module = pytypes.ModuleType(name)
+    module.__dict__.update(attrs)
+    return module
+
+
+def install_fakes():
+    """Подменяет внешние библиотеки в sys.modules фейками"""
+    telebot_types = _TypesModule('telebot.types')
+    apihelper = _module('telebot.apihelper', API_URL=None, FILE_URL=None, session=None,
+                        CONNECT_TIMEOUT=15, READ_TIMEOUT=30, ApiTelegramException=FakeBackendError)
+    telebot = _module('telebot', TeleBot=FakeTeleBot, types=telebot_types, apihelper=apihelper)
+
+    ym_exceptions = _module('yandex_music.exceptions', UnauthorizedError=FakeUnauthorizedError,
+                            NetworkError=FakeNetworkError)
+    ym_request = _module('yandex_music.utils.request', requests=None)
+    ym_utils = _module('yandex_music.utils', request=ym_request)
+    yandex_music = _module('yandex_music', Client=FakeYandexClient, exceptions=ym_exceptions, utils=ym_utils)
+
+    vk_audio = _module('vk_api.audio', VkAudio=FakeVkAudio)
+    vk_exceptions = _module('vk_api.exceptions', VkApiError=FakeVkApiError, ApiError=FakeApiError)
+    vk_api = _module('vk_api', VkApi=FakeVkApi, audio=vk_audio, exceptions=vk_exceptions)
+
+    yt_utils = _module('yt_dlp.utils', DownloadCancelled=FakeDownloadCancelled, DownloadError=FakeDownloadError)
+    yt_dlp = _module('yt_dlp', YoutubeDL=FakeYoutubeDL, utils=yt_utils)
+
+    sys.modules.update({
+        'telebot': telebot,
+        'telebot.types': telebot_types,
+        'telebot.apihelper': apihelper,
+        'yandex_music': yandex_music,
+        'yandex_music.exceptions': ym_exceptions,
+        'yandex_music.utils': ym_utils,
+        'yandex_music.utils.request': ym_request,
+        'vk_api': vk_api,
+        'vk_api.audio': vk_audio,
+        'vk_api.exceptions': vk_exceptions,
+        'yt_dlp': yt_dlp,
+        'yt_dlp.utils': yt_utils,
+    })
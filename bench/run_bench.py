@@ -0,0 +1,239 @@
+"""Нагрузочные сценарии для rty.py на фейковых бэкендах.
+
+Запуск из корня репозитория:
+    python -m bench.run_bench --scenario all --requests 200 --concurrency 8 \\
+        --latency telegram=40 --latency yandex=120 --latency vk=150 --error-rate yandex=0.02
+
+Для каждого сценария выводятся p50/p95/p99 задержки обработчика и пропускная способность.
+"""
+import argparse
+import concurrent.futures
+import importlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+from bench import fakes
+
+SCENARIOS = ['search', 'paging', 'download', 'youtube', 'inline']
+
+
+def percentile(values, pct):
+    """Перцентиль по методу ближайшего ранга"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def load_bot():
+    """Импортирует rty.py поверх фейков во временной рабочей папке"""
+    fakes.install_fakes()
+    os.environ.setdefault('BOT_TOKEN', 'bench:token')
+    os.environ.setdefault('YANDEX_MUSIC_TOKEN', 'bench')
+    os.environ.setdefault('VK_MANUAL_TOKEN', 'bench')
+
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if repo_root not in sys.path:
+        sys.path.insert(0, repo_root)
+    os.chdir(tempfile.mkdtemp(prefix='rty_bench_'))
+    rty = importlib.import_module('rty')
+    # Прямые загрузки файлов идут через общую HTTP-сессию бота
+    rty.http_session = fakes.FakeHttpSession()
+
+    # Скачивания бот ставит в свой пул и сразу отвечает; для замера задержки ждём задачу до конца
+    # (очередь пула скачиваний при этом учитывается) и переносим отметку об ошибке в поток запроса
+    def submit_and_wait(task, *args):
+        def run():
+            fakes.reset_request_state()
+            task(*args)
+            return fakes.request_failed()
+
+        if rty.download_executor.submit(run).result():
+            fakes.request_state.failed = True
+
+    rty.submit_download_job = submit_and_wait
+    return rty
+
+
+def backend_errors():
+    return {name: backend.errors for name, backend in fakes.BACKENDS.items()}
+
+
+def run_load(name, jobs, concurrency):
+    """Выполняет задания в пуле потоков и собирает задержки.
+    Перцентили считаются только по успешным запросам: быстрые ответы «❌» их бы занижали."""
+    latencies = []
+    errors = 0
+
+    def timed(job):
+        fakes.reset_request_state()
+        started = time.perf_counter()
+        try:
+            job()
+            error = fakes.request_failed()
+        except Exception as e:
+            error = e
+        return time.perf_counter() - started, error
+
+    errors_before = backend_errors()
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for elapsed, error in pool.map(timed, jobs):
+            if error:
+                errors += 1
+            else:
+                latencies.append(elapsed * 1000.0)
+    wall = time.perf_counter() - started
+    injected = {name: count - errors_before[name] for name, count in backend_errors().items()}
+
+    return {
+        'scenario': name,
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'backend_errors': {name: count for name, count in injected.items() if count},
+        'concurrency': concurrency,
+        'wall_s': round(wall, 3),
+        'throughput_rps': round((len(latencies) + errors) / wall, 2) if wall else 0.0,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'max_ms': round(max(latencies), 2) if latencies else 0.0,
+    }
+
+
+def scenario_search(rty, requests, concurrency):
+    """Всплеск /search от разных чатов с разными запросами"""
+    bot = rty.bot
+
+    def job(i):
+        return lambda: bot.dispatch_message(fakes.FakeMessage(10_000 + i, f"/search запрос {i % 50}"))
+
+    return run_load('search', [job(i) for i in range(requests)], concurrency)
+
+
+def scenario_paging(rty, requests, concurrency):
+    """Шквал нажатий «Вперёд/Назад» по уже найденным результатам"""
+    bot = rty.bot
+    chats = [20_000 + i for i in range(max(1, concurrency * 2))]
+    for chat_id in chats:
+        bot.dispatch_message(fakes.FakeMessage(chat_id, f"/search листание {chat_id}"))
+
+    def job(i):
+        chat_id = chats[i % len(chats)]
+        return lambda: bot.dispatch_callback(fakes.FakeCallbackQuery(chat_id, f"page_{i % 4}"))
+
+    return run_load('paging', [job(i) for i in range(requests)], concurrency)
+
+
+def scenario_download(rty, requests, concurrency):
+    """Параллельные скачивания треков Яндекса (уникальные треки, мимо кэша file_id)"""
+    bot = rty.bot
+
+    def job(i):
+        chat_id = 30_000 + i
+        return lambda: bot.dispatch_callback(fakes.FakeCallbackQuery(chat_id, f"dl_yandex_{900_000 + i}_{i}_0"))
+
+    return run_load('download', [job(i) for i in range(requests)], concurrency)
+
+
+def scenario_youtube(rty, requests, concurrency):
+    """Параллельные скачивания по ссылкам YouTube"""
+    bot = rty.bot
+
+    def job(i):
+        chat_id = 40_000 + i
+        url = f"https://www.youtube.com/watch?v=bench{i:06d}"
+        return lambda: bot.dispatch_message(fakes.FakeMessage(chat_id, url))
+
+    return run_load('youtube', [job(i) for i in range(requests)], concurrency)
+
+
+def scenario_inline(rty, requests, concurrency):
+    """Пользователи печатают inline-запрос по буквам; считаются ответы answer_inline_query"""
+    bot = rty.bot
+    words = ['кино', 'звезда', 'группа крови', 'полковник', 'мальчик на девятке']
+
+    def job(i):
+        def run():
+            user_id = 50_000 + i
+            query = f"{words[i % len(words)]} {i}"
+            for length in range(1, len(query) + 1):
+                bot.dispatch_inline(fakes.FakeInlineQuery(user_id, query[:length]))
+                time.sleep(0.05)
+            # Ждём срабатывания последнего отложенного поиска
+            time.sleep(rty.INLINE_DEBOUNCE_MS / 1000.0 + 0.2)
+        return run
+
+    before = sum(1 for method in bot.sent if method == 'answer_inline_query')
+    report = run_load('inline', [job(i) for i in range(requests)], concurrency)
+    report['inline_answers'] = sum(1 for method in bot.sent if method == 'answer_inline_query') - before
+    return report
+
+
+def parse_backend_values(items, cast=float):
+    values = {}
+    for item in items or []:
+        name, _, value = item.partition('=')
+        if name not in fakes.BACKENDS:
+            raise SystemExit(f"Неизвестный бэкенд: {name} (доступны: {', '.join(fakes.BACKENDS)})")
+        values[name] = cast(value)
+    return values
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочное тестирование rty.py на фейковых бэкендах")
+    parser.add_argument('--scenario', choices=SCENARIOS + ['all'], default='all')
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--latency', action='append', metavar='BACKEND=MS',
+                        help="средняя задержка бэкенда в мс (telegram, yandex, vk, youtube)")
+    parser.add_argument('--jitter', action='append', metavar='BACKEND=MS', help="разброс задержки в мс")
+    parser.add_argument('--error-rate', action='append', metavar='BACKEND=P', help="доля ошибок 0..1")
+    parser.add_argument('--json', action='store_true', help="вывести результаты в JSON")
+    args = parser.parse_args(argv)
+
+    # Задержки и ошибки включаются после загрузки бота: они относятся к сценариям, а не к инициализации клиентов
+    rty = load_bot()
+    for name, value in parse_backend_values(args.latency).items():
+        fakes.configure(name, latency_ms=value)
+    for name, value in parse_backend_values(args.jitter).items():
+        fakes.configure(name, jitter_ms=value)
+    for name, value in parse_backend_values(args.error_rate).items():
+        fakes.configure(name, error_rate=value)
+
+    runners = {
+        'search': scenario_search,
+        'paging': scenario_paging,
+        'download': scenario_download,
+        'youtube': scenario_youtube,
+        'inline': scenario_inline,
+    }
+    selected = SCENARIOS if args.scenario == 'all' else [args.scenario]
+    reports = [runners[name](rty, args.requests, args.concurrency) for name in selected]
+
+    backend_stats = {name: {'calls': b.calls, 'errors': b.errors} for name, b in fakes.BACKENDS.items()}
+
+    if args.json:
+        print(json.dumps({'scenarios': reports, 'backends': backend_stats}, ensure_ascii=False, indent=2))
+        return
+
+    header = (f"{'сценарий':<10} {'запросов':>8} {'ошибок':>7} {'сбоев':>6} {'rps':>9} "
+              f"{'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9}")
+    print(header)
+    print('-' * len(header))
+    for r in reports:
+        print(f"{r['scenario']:<10} {r['requests']:>8} {r['errors']:>7} {sum(r['backend_errors'].values()):>6} "
+              f"{r['throughput_rps']:>9} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9}")
+    print("(ошибок — запросов, завершившихся ответом «❌» или исключением; сбоев — внедрённых ошибок бэкендов;\n"
+          " перцентили — только по успешным запросам)")
+    print()
+    print("Вызовы бэкендов: " + ", ".join(f"{n}={s['calls']} (ошибок {s['errors']})"
+                                          for n, s in backend_stats.items()))
+
+
+if __name__ == '__main__':
+    main()
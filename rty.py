@@ -1,38 +1,234 @@
+import time
+
+_startup_started = time.perf_counter()
+
 import telebot
 import os
-import yt_dlp
 import re
-import time
+import sys
 import threading
 import concurrent.futures
+import multiprocessing
 import requests
 import json
+import socket
+import subprocess
+import uuid
+import functools
+import importlib
+import io
+import traceback
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
-from urllib.parse import urlparse, parse_qs, quote, unquote
-from yandex_music import Client
-from yandex_music.exceptions import UnauthorizedError, NetworkError
+from urllib.parse import urlparse, parse_qs, unquote, urljoin
 from telebot import types
-import vk_api
-from vk_api.audio import VkAudio
-from vk_api.exceptions import VkApiError, ApiError
+
+# Тяжёлые библиотеки бэкендов (yt_dlp, yandex_music, vk_api) импортируются лениво — см. load_backend_module
+startup_report = {'core': {'import_ms': (time.perf_counter() - _startup_started) * 1000, 'init_ms': 0.0}}
 
 # --- 1. ЗАГРУЗКА КОНФИГУРАЦИИ ---
 load_dotenv()
-bot = telebot.TeleBot(os.environ.get('BOT_TOKEN'))
+
+# --- Общий пул HTTP-соединений ---
+# Все клиенты (Telegram, Яндекс, VK, прямые загрузки) ходят через одни и те же адаптеры,
+# поэтому TLS-соединения с каждым хостом переиспользуются (keep-alive), а не открываются заново.
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 30))
+HTTP_DEFAULT_POOL_SIZE = int(os.environ.get('HTTP_DEFAULT_POOL_SIZE', 16))
+HTTP_POOL_SIZES = {
+    'api.telegram.org': int(os.environ.get('HTTP_POOL_TELEGRAM', 32)),
+    'api.music.yandex.net': int(os.environ.get('HTTP_POOL_YANDEX', 16)),
+    'api.vk.com': int(os.environ.get('HTTP_POOL_VK', 16)),
+}
+DNS_CACHE_TTL = int(os.environ.get('DNS_CACHE_TTL', 300))
+DNS_CACHE_SIZE = int(os.environ.get('DNS_CACHE_SIZE', 256))
+
+# Собственный сервер Bot API (telegram-bot-api --local): без лимита 50 МБ и с отправкой файлов по пути.
+# Бот должен быть предварительно отвязан от облачного API методом logOut.
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', '').rstrip('/')
+TELEGRAM_LOCAL_FILES = bool(TELEGRAM_API_URL) and \
+    os.environ.get('TELEGRAM_LOCAL_FILES', 'true').lower() in ('1', 'true', 'yes')
+# Загрузка больших файлов занимает дольше общего READ_TIMEOUT
+TELEGRAM_UPLOAD_TIMEOUT = int(os.environ.get('TELEGRAM_UPLOAD_TIMEOUT', 600 if TELEGRAM_LOCAL_FILES else 60))
+if TELEGRAM_API_URL:
+    HTTP_POOL_SIZES[urlparse(TELEGRAM_API_URL).netloc] = HTTP_POOL_SIZES['api.telegram.org']
+
+
+def _create_http_adapter(pool_size):
+    retries = Retry(total=2, connect=2, read=0, backoff_factor=0.3,
+                    status_forcelist=(502, 503, 504), allowed_methods=frozenset(['GET', 'HEAD']))
+    return HTTPAdapter(pool_connections=8, pool_maxsize=pool_size, max_retries=retries, pool_block=False)
+
+
+HTTP_DEFAULT_ADAPTER = _create_http_adapter(HTTP_DEFAULT_POOL_SIZE)
+HTTP_HOST_ADAPTERS = {host: _create_http_adapter(size) for host, size in HTTP_POOL_SIZES.items()}
+
+
+class PooledSession(requests.Session):
+    """Сессия на общих адаптерах с таймаутами по умолчанию"""
+
+    def __init__(self):
+        super().__init__()
+        self.mount('http://', HTTP_DEFAULT_ADAPTER)
+        self.mount('https://', HTTP_DEFAULT_ADAPTER)
+        for host, adapter in HTTP_HOST_ADAPTERS.items():
+            self.mount(f"http://{host}/", adapter)
+            self.mount(f"https://{host}/", adapter)
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+        return super().request(method, url, **kwargs)
+
+
+def reset_http_pools():
+    """Закрывает соединения пулов (нужно после fork, чтобы процессы не делили сокеты)"""
+    for adapter in [HTTP_DEFAULT_ADAPTER] + list(HTTP_HOST_ADAPTERS.values()):
+        adapter.poolmanager.clear()
+
+
+class _SessionRequests:
+    """Подмена модуля requests для библиотек, которые вызывают requests.request() напрямую"""
+
+    def __init__(self, session):
+        self._session = session
+
+    def request(self, method, url, **kwargs):
+        return self._session.request(method, url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+
+# Кэш DNS: getaddrinfo вызывается на каждое новое соединение.
+# TTL у всех записей одинаковый, поэтому порядок вставки совпадает с порядком истечения.
+_dns_cache = {}
+_dns_cache_lock = threading.Lock()
+_original_getaddrinfo = socket.getaddrinfo
+
+
+def _cached_getaddrinfo(host, port, *args, **kwargs):
+    key = (host, port, args, tuple(sorted(kwargs.items())))
+    now = time.time()
+    with _dns_cache_lock:
+        cached = _dns_cache.get(key)
+        if cached and cached[1] > now:
+            return cached[0]
+
+    result = _original_getaddrinfo(host, port, *args, **kwargs)
+    with _dns_cache_lock:
+        _dns_cache.pop(key, None)
+        _dns_cache[key] = (result, now + DNS_CACHE_TTL)
+        # Убираем истёкшие записи с начала и держим размер в пределах DNS_CACHE_SIZE
+        while _dns_cache:
+            oldest_key = next(iter(_dns_cache))
+            if _dns_cache[oldest_key][1] > now and len(_dns_cache) <= DNS_CACHE_SIZE:
+                break
+            del _dns_cache[oldest_key]
+    return result
+
+
+if DNS_CACHE_TTL > 0:
+    socket.getaddrinfo = _cached_getaddrinfo
+
+http_session = PooledSession()
+
+# Telegram: telebot берёт сессию из apihelper.session
+telebot.apihelper.session = http_session
+telebot.apihelper.CONNECT_TIMEOUT = HTTP_CONNECT_TIMEOUT
+telebot.apihelper.READ_TIMEOUT = HTTP_READ_TIMEOUT
+if TELEGRAM_API_URL:
+    telebot.apihelper.API_URL = TELEGRAM_API_URL + "/bot{0}/{1}"
+    telebot.apihelper.FILE_URL = TELEGRAM_API_URL + "/file/bot{0}/{1}"
+
+# Скачивания идут в отдельном пуле (DOWNLOAD_WORKERS), потоки обработчиков заняты только короткими запросами
+BOT_THREADS = int(os.environ.get('BOT_THREADS', 4))
+bot = telebot.TeleBot(os.environ.get('BOT_TOKEN'), num_threads=BOT_THREADS)
+
+# --- Ленивая загрузка бэкендов ---
+# Модуль бэкенда импортируется при первом обращении (или при старте, если бэкенд настроен),
+# время импорта и инициализации копится в startup_report для отчёта о холодном старте.
+PRELOAD_BACKENDS = [name.strip() for name in os.environ.get('PRELOAD_BACKENDS', '').split(',') if name.strip()]
+_backend_modules_lock = threading.Lock()
+_timed_backend_modules = set()
+
+
+def _startup_entry(backend):
+    return startup_report.setdefault(backend, {'import_ms': 0.0, 'init_ms': 0.0})
+
+
+def load_backend_module(backend, module_name):
+    """Импортирует модуль бэкенда при первом обращении, учитывая время импорта"""
+    # Всегда через import_module: если модуль ещё импортируется в другом потоке,
+    # он дождётся конца импорта, а не вернёт недоинициализированный модуль из sys.modules
+    already_loaded = module_name in sys.modules
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    if already_loaded:
+        return module
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    with _backend_modules_lock:
+        if module_name in _timed_backend_modules:
+            return module
+        _timed_backend_modules.add(module_name)
+        _startup_entry(backend)['import_ms'] += elapsed_ms
+    print(f"[Startup] {module_name} загружен за {elapsed_ms:.0f} мс")
+    return module
+
+
+def format_startup_report():
+    """Формирует отчёт о времени импорта и инициализации по бэкендам"""
+    lines = []
+    for backend, entry in startup_report.items():
+        lines.append(f"{backend:<8} импорт {entry['import_ms']:7.0f} мс, инициализация {entry['init_ms']:7.0f} мс")
+    total = (time.perf_counter() - _startup_started) * 1000
+    lines.append(f"{'всего':<8} {total:.0f} мс с начала запуска процесса")
+    return "\n".join(lines)
+
 
 # Инициализация клиента Яндекс.Музыки
 YM_TOKEN = os.environ.get('YANDEX_MUSIC_TOKEN')
 ym_client = None
-if YM_TOKEN:
+
+
+def init_yandex_client():
+    """Импортирует yandex_music и инициализирует клиент (только если указан токен)"""
+    global ym_client
+    if not YM_TOKEN:
+        return False
+
     try:
-        ym_client = Client(YM_TOKEN).init()
+        yandex_music = load_backend_module('yandex', 'yandex_music')
+        ym_exceptions = load_backend_module('yandex', 'yandex_music.exceptions')
+        ym_request_module = load_backend_module('yandex', 'yandex_music.utils.request')
+    except ImportError as e:
+        print(f"⚠️  Библиотека yandex-music не установлена: {e}")
+        return False
+
+    started = time.perf_counter()
+    try:
+        # yandex_music вызывает requests.request() напрямую — направляем его в общий пул
+        ym_request_module.requests = _SessionRequests(http_session)
+        ym_client = yandex_music.Client(YM_TOKEN).init()
         print("✅ Клиент Яндекс.Музыки успешно инициализирован.")
-    except UnauthorizedError:
+        return True
+    except ym_exceptions.UnauthorizedError:
         print("❌ Ошибка авторизации Яндекс.Музыки: неверный токен.")
-    except NetworkError:
+    except ym_exceptions.NetworkError:
         print("⚠️  Ошибка сети при подключении к Яндекс.Музыке.")
     except Exception as e:
         print(f"⚠️  Неизвестная ошибка инициализации Яндекс.Музыки: {e}")
+    finally:
+        _startup_entry('yandex')['init_ms'] += (time.perf_counter() - started) * 1000
+    return False
+
+
+init_yandex_client()
 
 # --- Инициализация клиента VK через ручной токен ---
 VK_MANUAL_TOKEN = os.environ.get('VK_MANUAL_TOKEN')
@@ -41,20 +237,35 @@ user_search_history = {}
 ym_client_lock = threading.Lock()
 vk_audio_lock = threading.Lock()
 
+# Кэш объектов треков Яндекса и информации для скачивания
+YM_TRACK_CACHE_SIZE = int(os.environ.get('YM_TRACK_CACHE_SIZE', 2000))
+YM_DOWNLOAD_INFO_TTL = int(os.environ.get('YM_DOWNLOAD_INFO_TTL', 50))
+yandex_tracks_cache = {}
+yandex_download_info_cache = {}
+yandex_direct_link_cache = {}
+yandex_cache_lock = threading.Lock()
+
 
 def init_vk_client():
     """Инициализирует VK клиент с ручным токеном из .env"""
     global vk_audio
     if VK_MANUAL_TOKEN:
+        started = None
         try:
-            # Используем vk_api.VkApi без дополнительных параметров
-            vk_session = vk_api.VkApi(token=VK_MANUAL_TOKEN)
-            vk_audio = VkAudio(vk_session)
+            vk_api = load_backend_module('vk', 'vk_api')
+            vk_api_audio = load_backend_module('vk', 'vk_api.audio')
+            started = time.perf_counter()
+            # Отдельная сессия (свои заголовки и cookies), но на общих пулах соединений
+            vk_session = vk_api.VkApi(token=VK_MANUAL_TOKEN, session=PooledSession())
+            vk_audio = vk_api_audio.VkAudio(vk_session)
             print("✅ Клиент ВК Музыки успешно инициализирован (ручной токен).")
             return True
         except Exception as e:
             print(f"⚠️  Ошибка инициализации ВК Музыки: {e}")
             print(f"⚠️  Убедитесь, что токен VK_MANUAL_TOKEN в .env файле корректен и не истёк.")
+        finally:
+            if started is not None:
+                _startup_entry('vk')['init_ms'] += (time.perf_counter() - started) * 1000
     else:
         print("⚠️  Токен VK (VK_MANUAL_TOKEN) не указан в .env файле.")
     return False
@@ -67,6 +278,584 @@ init_vk_client()
 AUDIO_CACHE_DIR = "audio_cache"
 os.makedirs(AUDIO_CACHE_DIR, exist_ok=True)
 
+# Счётчики работы бота. В многопроцессном режиме подменяются общим словарём супервизора
+bot_stats = {}
+bot_stats_lock = threading.Lock()
+
+
+def bump_stat(name, value=1):
+    """Увеличивает счётчик метрики"""
+    with bot_stats_lock:
+        bot_stats[name] = bot_stats.get(name, 0) + value
+
+
+# --- Трассировка запросов ---
+# Каждое обновление получает trace_id, этапы записываются как спаны в JSON Lines.
+# Формат полей совместим с OpenTelemetry: trace_id (32 hex), span_id (16 hex), время в наносекундах.
+# Запись в файл включается через TRACE_LOG_PATH; при превышении TRACE_LOG_MAX_MB файл уходит в .1.
+TRACE_LOG_PATH = os.environ.get('TRACE_LOG_PATH', '')
+TRACE_LOG_MAX_BYTES = int(os.environ.get('TRACE_LOG_MAX_MB', 50)) * 1024 * 1024
+TRACE_SLOW_MS = float(os.environ.get('TRACE_SLOW_MS', 5000))
+_trace_local = threading.local()
+_trace_write_lock = threading.Lock()
+_trace_file = None
+
+
+def current_trace():
+    """Возвращает трассировку текущего потока или None"""
+    return getattr(_trace_local, 'trace', None)
+
+
+def call_in_trace(trace, func, *args, **kwargs):
+    """Выполняет func в другом потоке так, чтобы её спаны попали в трассировку trace"""
+    previous = current_trace()
+    _trace_local.trace = trace
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _trace_local.trace = previous
+
+
+def record_span(name, start_ns, end_ns, error=None, **attrs):
+    """Добавляет завершённый спан в текущую трассировку"""
+    trace = current_trace()
+    if trace is None:
+        return
+
+    span_data = {
+        'span_id': uuid.uuid4().hex[:16],
+        'name': name,
+        'start_time_unix_nano': start_ns,
+        'end_time_unix_nano': end_ns,
+        'duration_ms': round((end_ns - start_ns) / 1e6, 2),
+        'attributes': attrs,
+    }
+    if error is not None:
+        span_data['status'] = {'code': 'ERROR', 'message': str(error)[:200]}
+    trace['spans'].append(span_data)
+
+
+@contextmanager
+def span(name, **attrs):
+    """Замеряет этап обработки как спан текущей трассировки"""
+    start_ns = time.time_ns()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        record_span(name, start_ns, time.time_ns(), error=error, **attrs)
+
+
+@contextmanager
+def traced_lock(lock, name):
+    """Захватывает блокировку, записывая время ожидания отдельным спаном"""
+    with span(f"{name}.lock_wait"):
+        lock.acquire()
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+def _append_trace_line(line):
+    """Дописывает строку в открытый файл трассировок, ротируя его по размеру"""
+    global _trace_file
+    with _trace_write_lock:
+        if _trace_file is None:
+            _trace_file = open(TRACE_LOG_PATH, 'a', encoding='utf-8')
+        _trace_file.write(line + "\n")
+        _trace_file.flush()
+        if _trace_file.tell() >= TRACE_LOG_MAX_BYTES:
+            _trace_file.close()
+            _trace_file = None
+            os.replace(TRACE_LOG_PATH, TRACE_LOG_PATH + '.1')
+
+
+def close_trace_log():
+    """Закрывает файл трассировок (воркер после fork открывает свой)"""
+    global _trace_file
+    with _trace_write_lock:
+        if _trace_file is not None:
+            _trace_file.close()
+            _trace_file = None
+
+
+def write_trace(trace):
+    """Пишет трассировку в JSON Lines и печатает медленные запросы"""
+    duration_ms = (trace['end_time_unix_nano'] - trace['start_time_unix_nano']) / 1e6
+    trace['duration_ms'] = round(duration_ms, 2)
+    bump_stat(f"updates.{trace['name']}")
+    bump_stat(f"updates.{trace['name']}.total_ms", int(duration_ms))
+
+    if TRACE_LOG_PATH:
+        try:
+            _append_trace_line(json.dumps(trace, ensure_ascii=False, default=str))
+        except Exception as e:
+            print(f"[Trace] Не удалось записать трассировку: {e}")
+
+    if duration_ms >= TRACE_SLOW_MS:
+        stages = ", ".join(f"{s['name']}={s['duration_ms']:.0f}мс"
+                           for s in sorted(trace['spans'], key=lambda s: -s['duration_ms'])[:5])
+        print(f"[Trace] 🐢 Медленный запрос {trace['trace_id']} ({trace['name']}, чат {trace['chat_id']}): "
+              f"{duration_ms:.0f}мс — {stages}")
+
+
+def new_trace(kind, handler_name, update, parent_trace_id=None, start_ns=None):
+    """Создаёт трассировку обработки обновления; parent_trace_id связывает её с породившим запросом"""
+    message = getattr(update, 'message', None) if hasattr(update, 'data') else update
+    chat = getattr(message, 'chat', None)
+    trace = {
+        'trace_id': uuid.uuid4().hex,
+        'name': kind,
+        'handler': handler_name,
+        'chat_id': chat.id if chat else getattr(getattr(update, 'from_user', None), 'id', None),
+        'start_time_unix_nano': start_ns or time.time_ns(),
+        'spans': [],
+    }
+    if parent_trace_id:
+        trace['parent_trace_id'] = parent_trace_id
+    return trace
+
+
+def run_traced(trace, handler, *args, **kwargs):
+    """Выполняет handler в трассировке trace и записывает её по завершении"""
+    _trace_local.trace = trace
+    try:
+        return handler(*args, **kwargs)
+    except BaseException as e:
+        trace['status'] = {'code': 'ERROR', 'message': str(e)[:200]}
+        raise
+    finally:
+        _trace_local.trace = None
+        trace['end_time_unix_nano'] = time.time_ns()
+        write_trace(trace)
+
+
+def trace_update(kind):
+    """Декоратор обработчика: открывает трассировку на время обработки одного обновления"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(update, *args, **kwargs):
+            if current_trace() is not None:
+                return handler(update, *args, **kwargs)
+            return run_traced(new_trace(kind, handler.__name__, update), handler, update, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+
+# Уровни качества: битрейт для Яндекса и формат/битрейт перекодирования для YouTube
+QUALITY_TIERS = {
+    'low': {'label': '🔈 Низкое', 'yandex_kbps': 0, 'youtube_format': 'worstaudio/worst', 'youtube_kbps': '64'},
+    'standard': {'label': '🔉 Стандартное', 'yandex_kbps': 192,
+                 'youtube_format': 'bestaudio[abr<=160]/bestaudio/best', 'youtube_kbps': '128'},
+    'high': {'label': '🔊 Высокое', 'yandex_kbps': 320, 'youtube_format': 'bestaudio/best', 'youtube_kbps': '320'},
+}
+QUALITY_ORDER = ['low', 'standard', 'high']
+DEFAULT_QUALITY = os.environ.get('DEFAULT_QUALITY', 'low')
+if DEFAULT_QUALITY not in QUALITY_TIERS:
+    DEFAULT_QUALITY = 'low'
+# Глобальный режим экономии трафика: все пользователи получают низкое качество
+FORCE_LOW_QUALITY = os.environ.get('FORCE_LOW_QUALITY', '').lower() in ('1', 'true', 'yes')
+user_quality = {}
+
+# Кэш отправленных файлов: (источник, id трека) -> {качество: file_id в Telegram}.
+# Все качества трека лежат под одним ключом, чтобы поиск делал один запрос к словарю
+# (в многопроцессном режиме это один IPC-вызов к менеджеру, а не по одному на качество)
+AUDIO_FILE_CACHE_SIZE = int(os.environ.get('AUDIO_FILE_CACHE_SIZE', 5000))
+audio_file_cache = {}
+audio_file_cache_lock = threading.Lock()
+
+
+def get_chat_quality(chat_id):
+    """Возвращает уровень качества для чата с учётом глобального режима экономии"""
+    if FORCE_LOW_QUALITY:
+        return 'low'
+    return user_quality.get(chat_id, DEFAULT_QUALITY)
+
+
+def get_cached_audio(source, track_id, quality):
+    """Ищет уже отправленный файл: сначала нужного качества, затем ближайшего из доступных"""
+    requested = QUALITY_ORDER.index(quality)
+    candidates = sorted(QUALITY_ORDER, key=lambda q: (abs(QUALITY_ORDER.index(q) - requested),
+                                                      -QUALITY_ORDER.index(q)))
+    # Чтение одного ключа атомарно (и у dict, и у DictProxy), блокировка нужна только записи
+    variants = audio_file_cache.get((source, str(track_id))) or {}
+    entry, found_tier = None, None
+    for tier in candidates:
+        entry = variants.get(tier)
+        if entry:
+            found_tier = tier
+            break
+
+    bump_stat('audio_cache.hit' if entry else 'audio_cache.miss')
+    return entry, found_tier
+
+
+def remember_audio(source, track_id, quality, sent_message, title, performer):
+    """Запоминает file_id отправленного аудио для повторной отправки без скачивания"""
+    audio = getattr(sent_message, 'audio', None)
+    if not audio:
+        return
+
+    with audio_file_cache_lock:
+        key = (source, str(track_id))
+        variants = dict(audio_file_cache.pop(key, None) or {})
+        variants[quality] = {'file_id': audio.file_id, 'title': title, 'performer': performer}
+        audio_file_cache[key] = variants
+        while len(audio_file_cache) > AUDIO_FILE_CACHE_SIZE:
+            audio_file_cache.pop(next(iter(audio_file_cache)))
+
+
+def send_cached_audio(chat_id, source, track_id, quality, caption):
+    """Отправляет аудио из кэша file_id. Возвращает True, если удалось"""
+    entry, tier = get_cached_audio(source, track_id, quality)
+    if not entry:
+        return False
+
+    try:
+        with span('telegram.send_audio', cached=True):
+            bot.send_audio(
+                chat_id=chat_id,
+                audio=entry['file_id'],
+                title=(entry['title'] or "Трек")[:64],
+                performer=entry['performer'][:64] if entry['performer'] else None,
+                caption=caption
+            )
+    except Exception as e:
+        print(f"[Cache] Не удалось отправить из кэша ({source}:{track_id}:{tier}): {e}")
+        with audio_file_cache_lock:
+            key = (source, str(track_id))
+            variants = dict(audio_file_cache.get(key) or {})
+            variants.pop(tier, None)
+            if variants:
+                audio_file_cache[key] = variants
+            else:
+                audio_file_cache.pop(key, None)
+        return False
+
+    print(f"[Cache] Отправлено из кэша {source}:{track_id} (запрошено {quality}, отдано {tier})")
+    return True
+
+
+def is_path_upload_error(error):
+    """Ошибка означает, что сервер не смог прочитать файл по пути (нет --local, другая ФС, нет доступа)"""
+    description = str(getattr(error, 'description', '') or error).lower()
+    return getattr(error, 'error_code', 400) == 400 and ('file' in description or 'url' in description)
+
+
+def _send_audio_file(chat_id, audio, title, performer, caption, upload):
+    with span('telegram.send_audio', cached=False, upload=upload):
+        return bot.send_audio(
+            chat_id=chat_id,
+            audio=audio,
+            title=title[:64] if title else "Трек",
+            performer=performer[:64] if performer else None,
+            caption=caption,
+            timeout=TELEGRAM_UPLOAD_TIMEOUT
+        )
+
+
+def send_track_audio(chat_id, audio_path, title, performer, caption, source, track_id, quality):
+    """Загружает аудиофайл в Telegram, запоминает file_id и удаляет локальный файл"""
+    try:
+        sent = None
+        if TELEGRAM_LOCAL_FILES:
+            # Локальный сервер читает файл сам, байты не гоняются через HTTP
+            try:
+                sent = _send_audio_file(chat_id, f"file://{os.path.abspath(audio_path)}",
+                                        title, performer, caption, 'path')
+                bump_stat('telegram.path_uploads')
+            except telebot.apihelper.ApiTelegramException as e:
+                # Остальные ошибки (бот заблокирован, чат не найден, 429) multipart не исправит
+                if not is_path_upload_error(e):
+                    raise
+                print(f"[Telegram] Сервер не принял файл по пути, отправляю multipart: {e}")
+                bump_stat('telegram.path_upload_fallbacks')
+
+        if sent is None:
+            with open(audio_path, 'rb') as audio_file:
+                sent = _send_audio_file(chat_id, audio_file, title, performer, caption, 'multipart')
+            bump_stat('telegram.multipart_uploads')
+        remember_audio(source, track_id, quality, sent, title, performer)
+        return sent
+    finally:
+        try:
+            os.remove(audio_path)
+        except:
+            pass
+
+
+# --- Задачи скачивания: отмена, лимиты и прогресс ---
+MAX_TRACK_DURATION = int(os.environ.get('MAX_TRACK_DURATION', 1800))
+# Облачный Bot API принимает от ботов файлы до 50 МБ, локальный сервер в режиме --local — до 2000 МБ
+MAX_FILE_MB = int(os.environ.get('MAX_FILE_MB', 2000 if TELEGRAM_LOCAL_FILES else 50))
+MAX_FILE_BYTES = MAX_FILE_MB * 1024 * 1024
+PROGRESS_EDIT_INTERVAL = float(os.environ.get('PROGRESS_EDIT_INTERVAL', 4))
+download_jobs = {}
+download_jobs_lock = threading.Lock()
+
+
+class JobCancelled(Exception):
+    """Скачивание отменено пользователем"""
+
+
+def create_cancel_keyboard(job):
+    """Создает клавиатуру с кнопкой отмены скачивания"""
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("✖️ Отмена", callback_data=f"cancel_{job['id']}"))
+    return markup
+
+
+def start_download_job(chat_id, message_id, text):
+    """Регистрирует задачу скачивания и показывает статус с кнопкой отмены"""
+    job = {
+        'id': uuid.uuid4().hex[:12],
+        'chat_id': chat_id,
+        'message_id': message_id,
+        'text': text,
+        'cancel': threading.Event(),
+        'last_edit': time.time(),
+    }
+    with download_jobs_lock:
+        download_jobs[job['id']] = job
+
+    try:
+        bot.edit_message_text(text, chat_id=chat_id, message_id=message_id,
+                              reply_markup=create_cancel_keyboard(job))
+    except Exception as e:
+        print(f"[Job] Не удалось показать статус задачи: {e}")
+    return job
+
+
+# Собственный пул для скачиваний: пока он занят, потоки telebot свободны и «Отмена» обрабатывается сразу
+DOWNLOAD_WORKERS = int(os.environ.get('DOWNLOAD_WORKERS', 4))
+download_executor = concurrent.futures.ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS,
+                                                          thread_name_prefix='rty-download')
+
+
+def submit_download_job(task, *args):
+    """Ставит задачу скачивания в пул скачиваний и сразу возвращает управление обработчику.
+    Трассировка обработчика к началу задачи уже записана, поэтому задача пишет свою
+    со ссылкой на неё (parent_trace_id) и спаном ожидания в очереди пула."""
+    parent = current_trace()
+    submitted_ns = time.time_ns()
+
+    def run():
+        trace = new_trace('download', getattr(task, '__name__', 'download'), args[0] if args else None,
+                          parent_trace_id=parent['trace_id'] if parent else None, start_ns=submitted_ns)
+        call_in_trace(trace, record_span, 'download.queue_wait', submitted_ns, time.time_ns())
+        try:
+            run_traced(trace, task, *args)
+        except Exception as e:
+            print(f"[Job] Ошибка задачи скачивания: {e}")
+
+    download_executor.submit(run)
+
+
+def finish_download_job(job):
+    """Убирает задачу из списка активных"""
+    with download_jobs_lock:
+        download_jobs.pop(job['id'], None)
+
+
+def check_job_cancelled(job):
+    """Прерывает скачивание, если пользователь нажал «Отмена»"""
+    if job is not None and job['cancel'].is_set():
+        raise JobCancelled()
+
+
+def check_download_limits(duration_sec, size_bytes):
+    """Возвращает текст ошибки, если трек превышает лимиты длительности или размера"""
+    if duration_sec and duration_sec > MAX_TRACK_DURATION:
+        return (f"Трек слишком длинный: {int(duration_sec) // 60} мин "
+                f"(максимум {MAX_TRACK_DURATION // 60} мин).")
+    if size_bytes and size_bytes > MAX_FILE_BYTES:
+        return f"Файл слишком большой: {size_bytes / 1024 / 1024:.1f} МБ (максимум {MAX_FILE_MB} МБ)."
+    return None
+
+
+def report_job_progress(job, done, total, unit='bytes'):
+    """Обновляет статус задачи не чаще раза в PROGRESS_EDIT_INTERVAL секунд"""
+    if job is None:
+        return
+
+    now = time.time()
+    if now - job['last_edit'] < PROGRESS_EDIT_INTERVAL:
+        return
+    job['last_edit'] = now
+
+    if unit == 'bytes':
+        done_text = f"{done / 1024 / 1024:.1f}" + (f"/{total / 1024 / 1024:.1f} МБ" if total else " МБ")
+    else:
+        done_text = f"{done}/{total} сегм."
+
+    progress_line = done_text
+    if total:
+        percent = min(100, int(done * 100 / total))
+        filled = percent // 10
+        progress_line = f"{'▓' * filled}{'░' * (10 - filled)} {percent}% ({done_text})"
+
+    try:
+        bot.edit_message_text(f"{job['text']}\n\n{progress_line}",
+                              chat_id=job['chat_id'],
+                              message_id=job['message_id'],
+                              reply_markup=create_cancel_keyboard(job))
+    except Exception:
+        pass
+
+
+def stream_to_file(url, filepath, job=None, headers=None, response=None):
+    """Скачивает файл потоком с проверкой отмены, лимита размера и отчётом о прогрессе.
+    Можно передать уже открытый ответ (stream=True) — тогда повторный запрос не делается."""
+    try:
+        if response is None:
+            response = http_session.get(url, headers=headers, stream=True)
+        with response:
+            response.raise_for_status()
+            total = int(response.headers.get('Content-Length') or 0)
+            limit_error = check_download_limits(None, total)
+            if limit_error:
+                raise ValueError(limit_error)
+
+            downloaded = 0
+            with open(filepath, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    check_job_cancelled(job)
+                    f.write(chunk)
+                    downloaded += len(chunk)
+                    report_job_progress(job, downloaded, total)
+    except BaseException:
+        try:
+            os.remove(filepath)
+        except:
+            pass
+        raise
+
+
+# Параллельная загрузка по диапазонам: хранилища ограничивают скорость одного соединения,
+# поэтому файл делится на куски Range, которые качаются несколькими соединениями из общего пула.
+RANGED_WORKERS = int(os.environ.get('RANGED_WORKERS', 4))
+RANGED_CHUNK_BYTES = int(os.environ.get('RANGED_CHUNK_KB', 1024)) * 1024
+RANGED_RETRIES = int(os.environ.get('RANGED_RETRIES', 3))
+
+
+def get_content_range_total(response):
+    """Размер файла из ответа 206 (Content-Range: bytes a-b/total), иначе None"""
+    if response.status_code != 206:
+        return None
+    total = response.headers.get('Content-Range', '').rpartition('/')[2]
+    return int(total) if total.isdigit() else None
+
+
+def _fetch_range(url, filepath, start, end, headers, job, abort, progress, progress_lock, response=None):
+    """Скачивает байты start..end в их место в файле; при обрыве диапазон качается заново.
+    response — уже открытый ответ на этот диапазон (первый кусок), используется в первой попытке."""
+    range_headers = dict(headers or {}, Range=f"bytes={start}-{end}")
+    for attempt in range(RANGED_RETRIES + 1):
+        written = 0
+        try:
+            if response is None:
+                response = http_session.get(url, headers=range_headers, stream=True)
+            with response:
+                if response.status_code != 206 or \
+                        not response.headers.get('Content-Range', '').startswith(f"bytes {start}-"):
+                    raise IOError(f"сервер не отдал диапазон {start}-{end} (HTTP {response.status_code})")
+                with open(filepath, 'r+b') as f:
+                    f.seek(start)
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        check_job_cancelled(job)
+                        if abort.is_set():
+                            raise JobCancelled()
+                        chunk = chunk[:end - start + 1 - written]
+                        f.write(chunk)
+                        written += len(chunk)
+                        with progress_lock:
+                            progress[0] += len(chunk)
+            if written != end - start + 1:
+                raise IOError(f"диапазон {start}-{end} оборвался на {written} байтах")
+            return
+        except JobCancelled:
+            raise
+        except Exception as e:
+            with progress_lock:
+                progress[0] -= written
+            if attempt == RANGED_RETRIES:
+                raise
+            bump_stat('ranged.retries')
+            print(f"[Ranged] Повтор диапазона {start}-{end} ({attempt + 1}/{RANGED_RETRIES}): {e}")
+            time.sleep(0.2 * (attempt + 1))
+        finally:
+            response = None
+
+
+def download_ranged(url, filepath, job=None, headers=None):
+    """Скачивает файл параллельными Range-запросами в заранее выделенный файл.
+    Запрос первого куска служит и проверкой: ответ 206 даёт размер файла, а его тело — начало файла;
+    если сервер диапазоны не поддерживает (200), тот же ответ просто дочитывается потоком.
+    В остальных случаях (206 без размера, 416 и т.п.) тело первого ответа — не весь файл,
+    поэтому он закрывается и файл качается обычным запросом без Range."""
+    try:
+        first_headers = dict(headers or {}, Range=f"bytes=0-{RANGED_CHUNK_BYTES - 1}")
+        first_response = http_session.get(url, headers=first_headers, stream=True)
+    except Exception as e:
+        print(f"[Ranged] Первый запрос не удался, качаю одним потоком: {e}")
+        return stream_to_file(url, filepath, job=job, headers=headers)
+
+    total = get_content_range_total(first_response)
+    if not total:
+        bump_stat('ranged.fallback')
+        if first_response.status_code == 200:
+            return stream_to_file(url, filepath, job=job, headers=headers, response=first_response)
+        first_response.close()
+        return stream_to_file(url, filepath, job=job, headers=headers)
+
+    limit_error = check_download_limits(None, total)
+    if limit_error:
+        first_response.close()
+        raise ValueError(limit_error)
+
+    ranges = [(start, min(start + RANGED_CHUNK_BYTES, total) - 1) for start in range(0, total, RANGED_CHUNK_BYTES)]
+    progress = [0]
+    progress_lock = threading.Lock()
+    abort = threading.Event()
+
+    try:
+        with open(filepath, 'wb') as f:
+            f.truncate(total)
+
+        with span('http.ranged', size=total, ranges=len(ranges)), \
+                concurrent.futures.ThreadPoolExecutor(max_workers=min(max(RANGED_WORKERS, 1), len(ranges))) as pool:
+            futures = [pool.submit(_fetch_range, url, filepath, start, end, headers, job, abort, progress,
+                                   progress_lock, first_response if start == 0 else None)
+                       for start, end in ranges]
+            pending = set(futures)
+            try:
+                while pending:
+                    done, pending = concurrent.futures.wait(pending, timeout=0.5,
+                                                            return_when=concurrent.futures.FIRST_EXCEPTION)
+                    for future in done:
+                        future.result()
+                    check_job_cancelled(job)
+                    report_job_progress(job, progress[0], total)
+            except BaseException:
+                # Останавливаем остальные диапазоны, чтобы они не докачивались впустую
+                abort.set()
+                for future in pending:
+                    future.cancel()
+                raise
+        bump_stat('ranged.downloads' if len(ranges) > 1 else 'ranged.single')
+    except BaseException:
+        first_response.close()
+        try:
+            os.remove(filepath)
+        except:
+            pass
+        raise
+
 
 def is_youtube_playlist(url):
     """Проверяет, является ли ссылка плейлистом YouTube"""
@@ -82,6 +871,130 @@ def is_youtube_playlist(url):
 
 
 # --- 3. ПОИСК В ЯНДЕКС.МУЗЫКЕ ---
+def remember_yandex_tracks(tracks):
+    """Сохраняет объекты треков из поиска, чтобы не запрашивать их повторно"""
+    with yandex_cache_lock:
+        for track in tracks:
+            if track is None or not getattr(track, 'id', None):
+                continue
+            key = str(track.id)
+            yandex_tracks_cache.pop(key, None)
+            yandex_tracks_cache[key] = track
+
+        while len(yandex_tracks_cache) > YM_TRACK_CACHE_SIZE:
+            yandex_tracks_cache.pop(next(iter(yandex_tracks_cache)))
+
+
+def get_yandex_tracks(track_keys):
+    """Возвращает треки по ключам 'track_id:album_id', недостающие запрашивает одним вызовом tracks()"""
+    found = {}
+    missing = []
+
+    with yandex_cache_lock:
+        for key in track_keys:
+            track_id = str(key).split(':')[0]
+            track = yandex_tracks_cache.get(track_id)
+            if track is not None:
+                found[track_id] = track
+            elif key not in missing:
+                missing.append(key)
+
+    if missing:
+        with traced_lock(ym_client_lock, 'yandex'), span('yandex.tracks', count=len(missing)):
+            fetched = ym_client.tracks(missing)
+        fetched = [track for track in (fetched or []) if track is not None]
+        remember_yandex_tracks(fetched)
+        for track in fetched:
+            found[str(track.id)] = track
+
+    return [found[str(key).split(':')[0]] for key in track_keys if str(key).split(':')[0] in found]
+
+
+def get_yandex_download_info(track):
+    """Возвращает список форматов трека, кэшируя его до истечения срока действия"""
+    track_id = str(track.id)
+    now = time.time()
+
+    with yandex_cache_lock:
+        cached = yandex_download_info_cache.get(track_id)
+        if cached and cached[1] > now:
+            return cached[0]
+
+    with traced_lock(ym_client_lock, 'yandex'), span('yandex.get_download_info'):
+        download_info = track.get_download_info()
+
+    with yandex_cache_lock:
+        for key in [k for k, v in yandex_download_info_cache.items() if v[1] <= now]:
+            del yandex_download_info_cache[key]
+        if download_info:
+            yandex_download_info_cache[track_id] = (download_info, now + YM_DOWNLOAD_INFO_TTL)
+
+    return download_info
+
+
+def get_yandex_direct_link(track, info):
+    """Возвращает прямую ссылку для (трек, кодек, битрейт), переиспользуя её пока она не истекла"""
+    key = (str(track.id), info.codec, info.bitrate_in_kbps)
+    now = time.time()
+
+    with yandex_cache_lock:
+        cached = yandex_direct_link_cache.get(key)
+        if cached and cached[1] > now:
+            return cached[0]
+
+    with span('yandex.get_direct_link', bitrate=info.bitrate_in_kbps):
+        direct_link = info.direct_link or info.get_direct_link()
+
+    with yandex_cache_lock:
+        for stale in [k for k, v in yandex_direct_link_cache.items() if v[1] <= now]:
+            del yandex_direct_link_cache[stale]
+        yandex_direct_link_cache[key] = (direct_link, now + YM_DOWNLOAD_INFO_TTL)
+
+    return direct_link
+
+
+def format_yandex_track(track):
+    """Приводит трек Яндекса к общему формату результатов поиска"""
+    title = track.title if hasattr(track, 'title') else ''
+    artists_str = ', '.join(
+        [artist.name for artist in track.artists]) if track.artists else 'Неизвестный исполнитель'
+    album_name = track.albums[0].title if track.albums else 'Неизвестный альбом'
+    album_id = track.albums[0].id if track.albums else 0
+    duration_ms = (track.duration_ms if hasattr(track, 'duration_ms') else 0) or 0
+    duration_str = f"{duration_ms // 60000}:{str((duration_ms % 60000) // 1000).zfill(2)}"
+
+    return {
+        'title': title,
+        'artists': artists_str,
+        'album': album_name,
+        'track_id': track.id,
+        'album_id': album_id,
+        'duration': duration_str,
+        'track_obj': track,
+        'source': 'yandex'
+    }
+
+
+def get_yandex_collection(kind, collection_id, limit=50):
+    """Возвращает название и треки плейлиста ('owner:kind') или альбома Яндекса"""
+    if kind == 'playlist':
+        owner, playlist_kind = collection_id.split(':', 1)
+        with traced_lock(ym_client_lock, 'yandex'), span('yandex.playlist'):
+            playlist = ym_client.users_playlists(playlist_kind, owner)
+        if not playlist:
+            return None, []
+        track_keys = [track_short.track_id for track_short in (playlist.tracks or [])[:limit]]
+        return playlist.title, get_yandex_tracks(track_keys)
+
+    with traced_lock(ym_client_lock, 'yandex'), span('yandex.album'):
+        album = ym_client.albums_with_tracks(int(collection_id))
+    if not album:
+        return None, []
+    tracks = [track for volume in (album.volumes or []) for track in volume][:limit]
+    remember_yandex_tracks(tracks)
+    return album.title, tracks
+
+
 def search_yandex_music(query, search_type="all", limit=15):
     """Ищет треки в Яндекс.Музыке."""
     if not ym_client:
@@ -90,7 +1003,8 @@ def search_yandex_music(query, search_type="all", limit=15):
 
     try:
         print(f"[Yandex] Поиск: '{query}' (тип: {search_type})")
-        search_result = ym_client.search(query, type_='track', page=0)
+        with span('yandex.search'):
+            search_result = ym_client.search(query, type_='track', page=0)
 
         if not search_result or not search_result.tracks:
             print(f"[Yandex] По запросу '{query}' ничего не найдено")
@@ -98,6 +1012,7 @@ def search_yandex_music(query, search_type="all", limit=15):
 
         tracks = search_result.tracks.results[:limit]
         print(f"[Yandex] Найдено {len(tracks)} треков по запросу '{query}'")
+        remember_yandex_tracks(tracks)
 
         formatted_results = []
         for track in tracks:
@@ -113,23 +1028,7 @@ def search_yandex_music(query, search_type="all", limit=15):
                     if query.lower() not in title.lower():
                         continue
 
-                artists_str = ', '.join(
-                    [artist.name for artist in track.artists]) if track.artists else 'Неизвестный исполнитель'
-                album_name = track.albums[0].title if track.albums else 'Неизвестный альбом'
-                album_id = track.albums[0].id if track.albums else 0
-                duration_ms = track.duration_ms if hasattr(track, 'duration_ms') else 0
-                duration_str = f"{duration_ms // 60000}:{str((duration_ms % 60000) // 1000).zfill(2)}"
-
-                formatted_results.append({
-                    'title': title,
-                    'artists': artists_str,
-                    'album': album_name,
-                    'track_id': track.id,
-                    'album_id': album_id,
-                    'duration': duration_str,
-                    'track_obj': track,
-                    'source': 'yandex'
-                })
+                formatted_results.append(format_yandex_track(track))
 
             except Exception as e:
                 print(f"[Yandex] Ошибка форматирования трека: {e}")
@@ -159,11 +1058,13 @@ def search_vk_music(query, limit=15):
             print("[VK] Не удалось инициализировать клиент")
             return []
 
+    vk_exceptions = load_backend_module('vk', 'vk_api.exceptions')
+
     try:
         print(f"[VK] Поиск: '{query}'")
 
         # Используем блокировку для потокобезопасности
-        with vk_audio_lock:
+        with traced_lock(vk_audio_lock, 'vk'), span('vk.search'):
             # Получаем итератор от search() и преобразуем его в список
             results_iter = vk_audio.search(q=query, count=limit)
             results = list(results_iter)  # Ключевое исправление здесь
@@ -201,6 +1102,7 @@ def search_vk_music(query, limit=15):
                     'url': url,
                     'track_id': track.get('id'),
                     'owner_id': track.get('owner_id'),
+                    'duration_sec': duration,
                     'source': 'vk'
                 })
 
@@ -211,7 +1113,7 @@ def search_vk_music(query, limit=15):
         print(f"[VK] Найдено {len(formatted_results)} треков по запросу '{query}'")
         return formatted_results
 
-    except (VkApiError, ApiError) as e:
+    except (vk_exceptions.VkApiError, vk_exceptions.ApiError) as e:
         # Обрабатываем ошибки API VK
         print(f"[VK] Ошибка API при поиске: {e}")
 
@@ -226,56 +1128,184 @@ def search_vk_music(query, limit=15):
         return []
 
 
+# --- 4.1. ПОИСК НА YOUTUBE ---
+def format_duration(duration_sec):
+    duration_sec = int(duration_sec or 0)
+    return f"{duration_sec // 60}:{str(duration_sec % 60).zfill(2)}"
+
+
+def search_youtube(query, limit=10):
+    """Ищет видео на YouTube: только метаданные из выдачи (extract_flat), без разбора форматов"""
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'socket_timeout': 10,
+        'extract_flat': 'in_playlist',
+        'skip_download': True,
+        'ignoreerrors': True,
+    }
+
+    try:
+        ydl = get_youtube_dl('search', ydl_opts)
+        with span('youtube.search', limit=limit):
+            info = ydl.extract_info(f"ytsearch{limit}:{query}", download=False)
+    except Exception as e:
+        print(f"[YouTube] Ошибка поиска: {e}")
+        return []
+
+    formatted_results = []
+    for entry in (info or {}).get('entries') or []:
+        if not entry or not entry.get('id'):
+            continue
+        duration = int(entry.get('duration') or 0)
+        formatted_results.append({
+            'title': entry.get('title') or 'Без названия',
+            'artist': entry.get('channel') or entry.get('uploader') or 'Неизвестный автор',
+            'duration': format_duration(duration),
+            'duration_sec': duration,
+            'track_id': entry['id'],
+            'url': f"https://www.youtube.com/watch?v={entry['id']}",
+            'source': 'youtube'
+        })
+
+    print(f"[YouTube] Найдено {len(formatted_results)} видео по запросу '{query}'")
+    return formatted_results
+
+
 # --- 5. СКАЧИВАНИЕ И ОБРАБОТКА ССЫЛОК ---
-def download_yandex_track_fast(track_id, album_id):
+def pick_yandex_format(download_info, quality):
+    """Выбирает формат mp3 под уровень качества: самый лёгкий для 'low', иначе лучший не выше цели"""
+    mp3_infos = [info for info in download_info if info.codec == 'mp3']
+    if not mp3_infos:
+        return download_info[0] if download_info else None
+
+    target = QUALITY_TIERS[quality]['yandex_kbps']
+    suitable = [info for info in mp3_infos if info.bitrate_in_kbps <= target]
+    if suitable:
+        return max(suitable, key=lambda x: x.bitrate_in_kbps)
+    return min(mp3_infos, key=lambda x: x.bitrate_in_kbps)
+
+
+def download_yandex_track_fast(track_id, album_id=None, quality='low', job=None):
     """Скачивает трек из Яндекс.Музыки"""
     if not ym_client:
         return None, None, None, "Клиент Яндекс.Музыки не настроен."
 
     try:
-        with ym_client_lock:
-            tracks = ym_client.tracks([f"{track_id}:{album_id}"])
+        tracks = get_yandex_tracks([f"{track_id}:{album_id}" if album_id else str(track_id)])
 
         if not tracks:
             return None, None, None, "Трек не найден."
 
         track = tracks[0]
+        duration_sec = (getattr(track, 'duration_ms', 0) or 0) / 1000
+        limit_error = check_download_limits(duration_sec, None)
+        if limit_error:
+            return None, None, None, limit_error
 
-        with ym_client_lock:
-            download_info = track.get_download_info()
+        download_info = get_yandex_download_info(track)
 
         if not download_info:
             return None, None, None, "Информация для скачивания недоступна."
 
-        best_info = min(
-            [info for info in download_info if info.codec == 'mp3'],
-            key=lambda x: x.bitrate_in_kbps,
-            default=None
-        )
-
+        best_info = pick_yandex_format(download_info, quality)
         if not best_info:
-            best_info = download_info[0] if download_info else None
-            if not best_info:
-                return None, None, None, "Нет подходящего формата."
+            return None, None, None, "Нет подходящего формата."
+
+        limit_error = check_download_limits(None, duration_sec * best_info.bitrate_in_kbps * 1000 / 8)
+        if limit_error:
+            return None, None, None, limit_error
+        check_job_cancelled(job)
 
         safe_title = "".join([c for c in track.title if c.isalnum() or c in (' ', '-', '_')]).strip()
         safe_artists = "_".join([a.name for a in track.artists[:1]]) if track.artists else "Unknown"
-        filename = f"{safe_artists} - {safe_title}.mp3"
+        # Суффикс uuid даёт каждой загрузке свой файл: одинаковые треки качаются параллельно
+        filename = f"{safe_artists} - {safe_title} [{quality}_{uuid.uuid4().hex[:8]}].mp3"
         filepath = os.path.join(AUDIO_CACHE_DIR, filename)
 
-        track.download(filepath, codec='mp3', bitrate_in_kbps=best_info.bitrate_in_kbps)
+        direct_link = get_yandex_direct_link(track, best_info)
+        try:
+            with span('yandex.download', bitrate=best_info.bitrate_in_kbps):
+                download_ranged(direct_link, filepath, job=job)
+        except JobCancelled:
+            raise
+        except Exception:
+            # Ссылка могла истечь раньше срока — забываем её, чтобы следующая попытка получила новую
+            with yandex_cache_lock:
+                yandex_direct_link_cache.pop((str(track.id), best_info.codec, best_info.bitrate_in_kbps), None)
+                yandex_download_info_cache.pop(str(track.id), None)
+            raise
         return filepath, track.title, ", ".join(
             [a.name for a in track.artists]) if track.artists else "Unknown Artist", "success"
 
+    except JobCancelled:
+        print(f"[Yandex] Скачивание трека {track_id} отменено")
+        return None, None, None, "cancelled"
     except Exception as e:
         print(f"[Yandex] Ошибка скачивания: {e}")
         return None, None, None, f"Ошибка скачивания: {str(e)}"
 
 
-def download_from_youtube_fast(query, is_url=False):
+def load_youtube_dl_module():
+    """Импортирует yt_dlp при первой загрузке с YouTube (реестр экстракторов грузится долго)"""
+    return load_backend_module('youtube', 'yt_dlp')
+
+
+# Экземпляры YoutubeDL живут в потоке и переиспользуются: так сохраняется их пул соединений
+_youtube_dl_local = threading.local()
+
+
+def get_youtube_dl(key, ydl_opts):
+    """Возвращает экземпляр YoutubeDL текущего потока для набора настроек"""
+    instances = getattr(_youtube_dl_local, 'instances', None)
+    if instances is None:
+        instances = _youtube_dl_local.instances = {}
+    if key not in instances:
+        instances[key] = load_youtube_dl_module().YoutubeDL(ydl_opts)
+    return instances[key]
+
+
+def youtube_progress_hook(d):
+    """Хук прогресса yt-dlp: отмена и обновление статуса задачи текущего потока"""
+    job = getattr(_youtube_dl_local, 'job', None)
+    if job is None:
+        return
+    if job['cancel'].is_set():
+        raise load_youtube_dl_module().utils.DownloadCancelled("Скачивание отменено пользователем")
+    if d.get('status') == 'downloading':
+        report_job_progress(job, d.get('downloaded_bytes') or 0,
+                            d.get('total_bytes') or d.get('total_bytes_estimate') or 0)
+
+
+def youtube_postprocessor_span_hook():
+    """Хук yt-dlp, записывающий работу постпроцессоров (ffmpeg) отдельными спанами"""
+    started = {}
+
+    def hook(d):
+        name = d.get('postprocessor', 'unknown')
+        if d.get('status') == 'started':
+            started[name] = time.time_ns()
+        elif d.get('status') == 'finished' and name in started:
+            record_span(f"youtube.postprocess.{name}", started.pop(name), time.time_ns())
+
+    return hook
+
+
+def transcode_to_mp3(source_path, filepath, quality):
+    """Перекодирует скачанную аудиодорожку в mp3 нужного битрейта"""
+    cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', '-i', source_path, '-vn',
+           '-c:a', 'libmp3lame', '-b:a', f"{QUALITY_TIERS[quality]['youtube_kbps']}k", '-f', 'mp3', filepath]
+    with span('youtube.ffmpeg', quality=quality):
+        result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode('utf-8', 'ignore').strip()[-200:] or "ошибка ffmpeg")
+
+
+def download_from_youtube_fast(query, is_url=False, quality='low', job=None):
     """Скачивает аудио с YouTube"""
+    tier = QUALITY_TIERS[quality]
     ydl_opts = {
-        'format': 'worstaudio/worst',
+        'format': tier['youtube_format'],
         'outtmpl': os.path.join(AUDIO_CACHE_DIR, '%(id)s.%(ext)s'),
         'quiet': True,
         'no_warnings': True,
@@ -284,65 +1314,409 @@ def download_from_youtube_fast(query, is_url=False):
         'postprocessors': [{
             'key': 'FFmpegExtractAudio',
             'preferredcodec': 'mp3',
-            'preferredquality': '64',
+            'preferredquality': tier['youtube_kbps'],
         }],
         'default_search': 'ytsearch1:' if not is_url else None,
         'noplaylist': True,
         'nocheckcertificate': True,
         'ignoreerrors': True,
+        'progress_hooks': [youtube_progress_hook],
+        'postprocessor_hooks': [youtube_postprocessor_span_hook()],
     }
+    yt_dlp = load_youtube_dl_module()
 
     try:
         if is_url and is_youtube_playlist(query):
             return None, None, None, "playlist"
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(query, download=True)
+        ydl = get_youtube_dl((quality, is_url), ydl_opts)
+        _youtube_dl_local.job = job
 
-            if not info:
-                return None, None, None, "no_info"
+        # Сначала только метаданные: длительность и размер проверяются до скачивания
+        with span('youtube.extract_info', quality=quality):
+            info = ydl.extract_info(query, download=False)
 
-            if 'entries' in info:
-                video = info['entries'][0] if info['entries'] else None
-            else:
-                video = info
+        if not info:
+            return None, None, None, "no_info"
 
-            if not video:
-                return None, None, None, "no_video"
+        if 'entries' in info:
+            entries = list(info['entries'] or [])
+            video = entries[0] if entries else None
+        else:
+            video = info
+
+        if not video:
+            return None, None, None, "no_video"
+
+        duration = video.get('duration') or 0
+        limit_error = check_download_limits(duration, duration * int(tier['youtube_kbps']) * 1000 / 8)
+        if limit_error:
+            return None, None, None, limit_error
+        check_job_cancelled(job)
+
+        title = video.get('title', 'Без названия')
+        uploader = video.get('uploader', 'Неизвестный автор')
+        safe_name = "".join([c for c in f"{uploader[:20]} - {title[:30]}" if c.isalnum() or c in (' ', '-', '_')])
+        new_path = os.path.join(AUDIO_CACHE_DIR,
+                                f"{safe_name.strip()} [{video.get('id')}_{quality}_{uuid.uuid4().hex[:8]}].mp3")
+
+        # Одиночный http-формат качаем сами параллельными диапазонами и перекодируем ffmpeg;
+        # DASH/HLS-форматы и склейки нескольких потоков остаются yt-dlp
+        if video.get('url') and video.get('protocol') in ('http', 'https') and not video.get('requested_formats'):
+            source_path = os.path.join(AUDIO_CACHE_DIR,
+                                       f"{video.get('id')}_{uuid.uuid4().hex[:8]}.{video.get('ext') or 'audio'}")
+            try:
+                with span('youtube.download', quality=quality, ranged=True):
+                    download_ranged(video['url'], source_path, job=job, headers=video.get('http_headers'))
+                check_job_cancelled(job)
+                transcode_to_mp3(source_path, new_path, quality)
+            finally:
+                try:
+                    os.remove(source_path)
+                except:
+                    pass
+            return new_path, title, uploader, "success"
 
-            title = video.get('title', 'Без названия')
-            uploader = video.get('uploader', 'Неизвестный автор')
+        with span('youtube.download', quality=quality):
+            video = ydl.process_ie_result(video, download=True)
+        check_job_cancelled(job)
 
-            for file in os.listdir(AUDIO_CACHE_DIR):
-                if file.endswith('.mp3'):
-                    audio_path = os.path.join(AUDIO_CACHE_DIR, file)
-                    new_name = f"{uploader[:20]} - {title[:30]}.mp3"
-                    new_path = os.path.join(AUDIO_CACHE_DIR, new_name)
-                    try:
-                        os.rename(audio_path, new_path)
-                        return new_path, title, uploader, "success"
-                    except:
-                        return audio_path, title, uploader, "success"
+        if not video:
+            return None, None, None, "no_video"
 
+        # Путь итогового mp3 именно этого видео (в папке могут лежать файлы параллельных загрузок)
+        requested = video.get('requested_downloads') or []
+        audio_path = requested[0].get('filepath') if requested else None
+        if not audio_path:
+            audio_path = os.path.splitext(ydl.prepare_filename(video))[0] + '.mp3'
+
+        if not os.path.exists(audio_path):
             return None, title, uploader, "no_file"
 
+        try:
+            os.rename(audio_path, new_path)
+            return new_path, title, uploader, "success"
+        except:
+            return audio_path, title, uploader, "success"
+
+    except (JobCancelled, yt_dlp.utils.DownloadCancelled):
+        print(f"[YouTube] Скачивание '{query}' отменено")
+        return None, None, None, "cancelled"
     except Exception as e:
         print(f"[!] Ошибка YouTube: {e}")
         return None, None, None, "error"
+    finally:
+        _youtube_dl_local.job = None
+
+
+# Загрузка из VK: треки отдаются как HLS-плейлисты из множества мелких (часто зашифрованных) сегментов
+VK_HLS_WORKERS = int(os.environ.get('VK_HLS_WORKERS', 8))
+VK_HTTP_TIMEOUT = int(os.environ.get('VK_HTTP_TIMEOUT', 15))
+VK_SEGMENT_RETRIES = 2
+
+
+def _parse_hls_attributes(text):
+    """Разбирает атрибуты тега вида KEY=VALUE,KEY2="VALUE2" """
+    return {key: value.strip('"') for key, value in re.findall(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)', text)}
+
+
+def parse_hls_playlist(text, base_url):
+    """Разбирает media-плейлист HLS в список сегментов с параметрами шифрования"""
+    segments = []
+    sequence = 0
+    key = None
+    pending_segment = False
+
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            sequence = int(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-KEY:'):
+            attrs = _parse_hls_attributes(line.split(':', 1)[1])
+            if attrs.get('METHOD', 'NONE') == 'NONE':
+                key = None
+            else:
+                key = {
+                    'method': attrs['METHOD'],
+                    'uri': urljoin(base_url, attrs['URI']),
+                    'iv': bytes.fromhex(attrs['IV'][2:]) if attrs.get('IV') else None,
+                }
+        elif line.startswith('#EXTINF'):
+            pending_segment = True
+        elif not line.startswith('#') and pending_segment:
+            segments.append({
+                'url': urljoin(base_url, line),
+                'key': key,
+                # Если IV не указан, по спецификации используется номер сегмента
+                'iv': (key['iv'] or sequence.to_bytes(16, 'big')) if key else None,
+            })
+            sequence += 1
+            pending_segment = False
+
+    return segments
+
+
+def _fetch_hls_segment(segment, keys):
+    """Скачивает и при необходимости расшифровывает один сегмент"""
+    last_error = None
+    for _ in range(VK_SEGMENT_RETRIES + 1):
+        try:
+            response = http_session.get(segment['url'], timeout=VK_HTTP_TIMEOUT)
+            response.raise_for_status()
+            data = response.content
+            break
+        except requests.RequestException as e:
+            last_error = e
+    else:
+        raise last_error
+
+    if segment['key']:
+        if segment['key']['method'] != 'AES-128':
+            raise ValueError(f"Неподдерживаемое шифрование HLS: {segment['key']['method']}")
+        # AES есть среди зависимостей только в yt-dlp; импортируется весь пакет yt_dlp,
+        # поэтому время относится к youtube и тратится лишь на зашифрованные сегменты
+        yt_dlp_aes = load_backend_module('youtube', 'yt_dlp.aes')
+        data = yt_dlp_aes.unpad_pkcs7(yt_dlp_aes.aes_cbc_decrypt_bytes(data, keys[segment['key']['uri']],
+                                                                       segment['iv']))
+    return data
+
+
+def download_hls_audio(playlist_url, job=None):
+    """Скачивает HLS-поток: сегменты параллельно, склейка в памяти. Возвращает байты MPEG-TS"""
+    response = http_session.get(playlist_url, timeout=VK_HTTP_TIMEOUT)
+    response.raise_for_status()
+    playlist = response.text
+
+    # Мастер-плейлист: берём последний (обычно лучший) вариант
+    if '#EXT-X-STREAM-INF' in playlist:
+        variants = [line.strip() for line in playlist.splitlines() if line.strip() and not line.startswith('#')]
+        playlist_url = urljoin(playlist_url, variants[-1])
+        response = http_session.get(playlist_url, timeout=VK_HTTP_TIMEOUT)
+        response.raise_for_status()
+        playlist = response.text
+
+    segments = parse_hls_playlist(playlist, playlist_url)
+    if not segments:
+        raise ValueError("Плейлист не содержит сегментов")
+
+    keys = {}
+    for key_uri in {segment['key']['uri'] for segment in segments if segment['key']}:
+        key_response = http_session.get(key_uri, timeout=VK_HTTP_TIMEOUT)
+        key_response.raise_for_status()
+        keys[key_uri] = key_response.content
+
+    done = [0]
+    done_lock = threading.Lock()
+
+    def fetch(segment):
+        check_job_cancelled(job)
+        data = _fetch_hls_segment(segment, keys)
+        with done_lock:
+            done[0] += 1
+            count = done[0]
+        report_job_progress(job, count, len(segments), unit='segments')
+        return data
+
+    with span('vk.hls_segments', segments=len(segments)):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=VK_HLS_WORKERS) as pool:
+            chunks = list(pool.map(fetch, segments))
+
+    return b''.join(chunks)
+
+
+def remux_to_mp3(data, filepath, quality):
+    """Перепаковывает поток в mp3 через ffmpeg без перекодирования, при неудаче — перекодирует"""
+    base_cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', '-i', 'pipe:0', '-vn']
+    with span('vk.ffmpeg'):
+        result = subprocess.run(base_cmd + ['-c:a', 'copy', '-f', 'mp3', filepath],
+                                input=data, capture_output=True)
+        if result.returncode != 0:
+            result = subprocess.run(base_cmd + ['-c:a', 'libmp3lame',
+                                                '-b:a', f"{QUALITY_TIERS[quality]['youtube_kbps']}k",
+                                                '-f', 'mp3', filepath],
+                                    input=data, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode('utf-8', 'ignore').strip()[-200:] or "ошибка ffmpeg")
+
+
+def get_vk_track(chat_id, owner_id, track_id):
+    """Находит трек VK в последних результатах поиска чата, иначе запрашивает его заново"""
+    history = user_search_history.get(chat_id)
+    if history:
+        for result in history['results']:
+            if result.get('source') == 'vk' and str(result.get('owner_id')) == str(owner_id) \
+                    and str(result.get('track_id')) == str(track_id):
+                return result
+
+    if not vk_audio and not init_vk_client():
+        return None
+
+    with traced_lock(vk_audio_lock, 'vk'), span('vk.get_audio_by_id'):
+        track = vk_audio.get_audio_by_id(int(owner_id), int(track_id))
+    if not track or not track.get('url'):
+        return None
+    return {
+        'title': track.get('title', 'Без названия'),
+        'artist': track.get('artist', 'Неизвестный исполнитель'),
+        'url': track.get('url'),
+        'track_id': track.get('id'),
+        'owner_id': track.get('owner_id'),
+        'duration_sec': track.get('duration', 0),
+        'source': 'vk'
+    }
+
+
+def download_vk_track_fast(track, quality='low', job=None):
+    """Скачивает трек VK (HLS или прямой mp3)"""
+    url = track.get('url')
+    if not url:
+        return None, None, None, "Нет ссылки на трек."
+
+    title = track.get('title', 'Без названия')
+    artist = track.get('artist', 'Неизвестный исполнитель')
+    safe_title = "".join([c for c in f"{artist} - {title}" if c.isalnum() or c in (' ', '-', '_')]).strip()
+    filepath = os.path.join(AUDIO_CACHE_DIR, f"{safe_title[:60]} [vk{track.get('owner_id')}_{track.get('track_id')}_"
+                                             f"{uuid.uuid4().hex[:8]}].mp3")
+
+    limit_error = check_download_limits(track.get('duration_sec'), None)
+    if limit_error:
+        return None, None, None, limit_error
+
+    try:
+        if '.m3u8' in urlparse(url).path:
+            data = download_hls_audio(url, job=job)
+            check_job_cancelled(job)
+            remux_to_mp3(data, filepath, quality)
+        else:
+            with span('vk.download'):
+                download_ranged(url, filepath, job=job)
+        return filepath, title, artist, "success"
+
+    except JobCancelled:
+        print(f"[VK] Скачивание трека {track.get('owner_id')}_{track.get('track_id')} отменено")
+        return None, None, None, "cancelled"
+    except Exception as e:
+        print(f"[VK] Ошибка скачивания: {e}")
+        try:
+            os.remove(filepath)
+        except:
+            pass
+        return None, None, None, f"Ошибка скачивания: {str(e)}"
+
+
+# --- Распознавание ссылок ---
+# Каждый источник регистрирует заранее скомпилированные шаблоны, которые переводят любую
+# поддерживаемую ссылку в канонический ключ (источник, тип, id). По этому ключу работает кэш,
+# поэтому youtu.be/X, music.youtube.com/watch?v=X и shorts/X попадают в одну запись.
+MUSIC_LINK_PREFILTER = re.compile(r'music\.yandex\.|youtube\.com|youtu\.be|vk\.(?:com|ru)/audio', re.IGNORECASE)
+URL_RESOLVERS = []
+
+
+def register_url_resolver(source, kind, pattern, build_id):
+    """Регистрирует шаблон ссылки; build_id(match) возвращает канонический id"""
+    URL_RESOLVERS.append({
+        'source': source,
+        'kind': kind,
+        'regex': re.compile(pattern, re.IGNORECASE),
+        'build_id': build_id,
+    })
+
+
+def resolve_music_url(text):
+    """Находит в тексте поддерживаемую ссылку и возвращает (источник, тип, id) или None"""
+    if not text or not MUSIC_LINK_PREFILTER.search(text):
+        return None
+    for resolver in URL_RESOLVERS:
+        match = resolver['regex'].search(text)
+        if match:
+            return resolver['source'], resolver['kind'], resolver['build_id'](match)
+    return None
+
+
+# Яндекс.Музыка: треки с альбомом и без, альбомы, пользовательские плейлисты
+register_url_resolver('yandex', 'track', r'music\.yandex\.\w+/album/(\d+)/track/(\d+)',
+                      lambda m: f"{m.group(2)}:{m.group(1)}")
+register_url_resolver('yandex', 'track', r'music\.yandex\.\w+/track/(\d+)', lambda m: m.group(1))
+register_url_resolver('yandex', 'album', r'music\.yandex\.\w+/album/(\d+)', lambda m: m.group(1))
+register_url_resolver('yandex', 'playlist', r'music\.yandex\.\w+/users/([^/?#\s]+)/playlists/(\d+)',
+                      lambda m: f"{unquote(m.group(1))}:{m.group(2)}")
+
+# YouTube: watch (в т.ч. music. и m.), youtu.be, shorts, embed; чистые плейлисты отдельно
+register_url_resolver('youtube', 'video',
+                      r'(?:www\.|m\.|music\.)?youtube\.com/watch\?(?:[^\s#]*&)?v=([\w-]{11})', lambda m: m.group(1))
+register_url_resolver('youtube', 'video', r'youtu\.be/([\w-]{11})', lambda m: m.group(1))
+register_url_resolver('youtube', 'video', r'youtube\.com/(?:shorts|embed|live)/([\w-]{11})', lambda m: m.group(1))
+register_url_resolver('youtube', 'playlist', r'youtube\.com/playlist\?(?:[^\s#]*&)?list=([\w-]+)',
+                      lambda m: m.group(1))
+
+# VK: vk.com/audio<owner>_<id> (в т.ч. m.vk.com и vk.ru)
+register_url_resolver('vk', 'track', r'vk\.(?:com|ru)/audio(-?\d+)_(\d+)', lambda m: f"{m.group(1)}_{m.group(2)}")
 
 
 # --- 6. УНИВЕРСАЛЬНЫЙ ПОИСК ---
+# Кэш результатов поиска: повторные и inline-запросы не ходят в бэкенды
+SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL', 300))
+SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', 1000))
+search_cache = {}
+search_cache_lock = threading.Lock()
+# Долгоживущие потоки поиска: в них сохраняются экземпляры YoutubeDL (см. get_youtube_dl)
+SEARCH_THREADS = int(os.environ.get('SEARCH_THREADS', 6))
+search_executor = concurrent.futures.ThreadPoolExecutor(max_workers=SEARCH_THREADS, thread_name_prefix='rty-search')
+
+
 def unified_search(query, source="all", search_type="all", limit=10):
     """Универсальная функция поиска музыки."""
-    results = []
+    cache_key = (query.strip().lower(), source, search_type, limit)
+    now = time.time()
+    with search_cache_lock:
+        cached = search_cache.get(cache_key)
+        if cached and cached[1] > now:
+            bump_stat('search_cache.hit')
+            # Копии, т.к. фильтры и пагинация меняют global_index у результатов
+            return [dict(result) for result in cached[0]]
+
+    bump_stat('search_cache.miss')
+    results = _unified_search_uncached(query, source, search_type, limit)
+
+    if results:
+        with search_cache_lock:
+            search_cache.pop(cache_key, None)
+            search_cache[cache_key] = ([dict(result) for result in results], now + SEARCH_CACHE_TTL)
+            while len(search_cache) > SEARCH_CACHE_SIZE:
+                search_cache.pop(next(iter(search_cache)))
+
+    return results
 
-    if source in ["all", "yandex"] and ym_client:
-        yandex_results = search_yandex_music(query, search_type, limit)
-        results.extend(yandex_results)
 
+def is_search_cached(query, source="all", search_type="all", limit=10):
+    """Проверяет, есть ли свежий результат поиска в кэше"""
+    cached = search_cache.get((query.strip().lower(), source, search_type, limit))
+    return bool(cached and cached[1] > time.time())
+
+
+def _unified_search_uncached(query, source, search_type, limit):
+    searches = []
+    if source in ["all", "yandex"] and ym_client:
+        searches.append(('yandex', lambda: search_yandex_music(query, search_type, limit)))
     if source in ["all", "vk"]:
-        vk_results = search_vk_music(query, limit)
-        results.extend(vk_results)
+        searches.append(('vk', lambda: search_vk_music(query, limit)))
+    if source in ["all", "youtube"]:
+        searches.append(('youtube', lambda: search_youtube(query, limit)))
+
+    # Бэкенды опрашиваются параллельно: время поиска — по самому медленному, а не сумма
+    results = []
+    if len(searches) == 1:
+        results.extend(searches[0][1]())
+    elif searches:
+        trace = current_trace()
+        futures = [(name, search_executor.submit(call_in_trace, trace, search)) for name, search in searches]
+        for name, future in futures:
+            try:
+                results.extend(future.result())
+            except Exception as e:
+                print(f"[Search] Ошибка поиска ({name}): {e}")
 
     for i, result in enumerate(results):
         result['global_index'] = i + 1
@@ -350,6 +1724,13 @@ def unified_search(query, source="all", search_type="all", limit=10):
     return results
 
 
+SOURCE_LABELS = {
+    'yandex': ("🎵", "Яндекс.Музыка"),
+    'vk': ("🎧", "ВК Музыка"),
+    'youtube': ("🎬", "YouTube"),
+}
+
+
 def show_search_results(chat_id, query, results, page=0):
     """Показывает результаты поиска"""
     if not results:
@@ -369,14 +1750,16 @@ def show_search_results(chat_id, query, results, page=0):
 
     yandex_count = len([r for r in results if r.get('source') == 'yandex'])
     vk_count = len([r for r in results if r.get('source') == 'vk'])
+    youtube_count = len([r for r in results if r.get('source') == 'youtube'])
 
-    message_text += f"*Найдено:* {len(results)} треков (🎵 Яндекс: {yandex_count}, 🎧 ВК: {vk_count})\n"
+    message_text += (f"*Найдено:* {len(results)} треков (🎵 Яндекс: {yandex_count}, 🎧 ВК: {vk_count}, "
+                     f"🎬 YouTube: {youtube_count})\n")
     message_text += f"*Страница:* {page + 1}/{(len(results) + 4) // 5}\n\n"
 
     for track in page_results:
         idx = track.get('global_index', 0)
         title = track.get('title', 'Без названия')
-        source_icon = "🎵" if track.get('source') == 'yandex' else "🎧"
+        source_icon = SOURCE_LABELS.get(track.get('source'), ("🎧", ""))[0]
 
         if track.get('source') == 'yandex':
             artists = track.get('artists', 'Неизвестный исполнитель')
@@ -404,14 +1787,15 @@ def create_search_keyboard(results, page=0, results_per_page=5):
     page_results = results[start_idx:end_idx]
 
     for track in page_results:
-        source_icon = "🎵" if track.get('source') == 'yandex' else "🎧"
+        source_icon = SOURCE_LABELS.get(track.get('source'), ("🎧", ""))[0]
         btn_text = f"{source_icon} {track.get('global_index', 0)}. {track.get('title', 'Трек')[:15]}..."
         if track.get('source') == 'yandex':
             btn_data = f"dl_yandex_{track.get('track_id', 0)}_{track.get('album_id', 0)}_{page}"
+        elif track.get('source') == 'youtube':
+            btn_data = f"dl_yt_{track.get('track_id')}_{page}"
         else:
-            # Для VK отправляем информацию о треке
-            url_encoded = quote(track.get('url', ''), safe='')
-            btn_data = f"info_vk_{track.get('track_id', 0)}_{track.get('owner_id', 0)}_{url_encoded[:100]}_{page}"
+            # Ссылка VK в callback_data не помещается — трек найдётся по id в истории поиска
+            btn_data = f"dl_vk_{track.get('owner_id', 0)}_{track.get('track_id', 0)}_{page}"
         markup.add(types.InlineKeyboardButton(btn_text, callback_data=btn_data))
 
     nav_buttons = []
@@ -427,7 +1811,8 @@ def create_search_keyboard(results, page=0, results_per_page=5):
     filter_buttons = [
         types.InlineKeyboardButton("🔄 Новый поиск", callback_data="new_search"),
         types.InlineKeyboardButton("🎵 Только Яндекс", callback_data="filter_yandex"),
-        types.InlineKeyboardButton("🎧 Только ВК", callback_data="filter_vk")
+        types.InlineKeyboardButton("🎧 Только ВК", callback_data="filter_vk"),
+        types.InlineKeyboardButton("🎬 Только YouTube", callback_data="filter_youtube")
     ]
 
     markup.add(*filter_buttons)
@@ -439,6 +1824,7 @@ def create_search_keyboard(results, page=0, results_per_page=5):
 
 # Новые команды для проверки статуса
 @bot.message_handler(commands=['status', 'check_vk', 'check'])
+@trace_update('command')
 def handle_status(message):
     """Показывает статус подключения к сервисам"""
     status_text = "📊 *Статус подключений бота*\n\n"
@@ -469,6 +1855,7 @@ def handle_status(message):
 
 
 @bot.message_handler(commands=['start', 'help'])
+@trace_update('command')
 def send_welcome(message):
     keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
     btn_liked = types.KeyboardButton('🎵 Мне понравилось')
@@ -485,18 +1872,21 @@ def send_welcome(message):
         "• Скачивать треки из *YouTube* (по названию или ссылке)\n"
         "• Скачивать треки из *Яндекс.Музыки* (по ссылке или через поиск)\n"
         "• 🔍 *Искать и скачивать треки из Яндекс.Музыки*\n"
-        "• 🎧 *Искать треки из ВК Музыки*\n"
+        "• 🎧 *Искать и скачивать треки из ВК Музыки*\n"
+        "• 🎬 *Искать и скачивать аудио с YouTube*\n"
         "• 📥 Скачивать треки из 'Мне понравилось' (в разработке)\n\n"
         "*Основные команды:*\n"
         "• `/search <запрос>` - поиск во всех источниках\n"
         "• `/search_yandex <запрос>` - поиск только в Яндекс.Музыке\n"
         "• `/search_vk <запрос>` - поиск только в ВК Музыке\n"
+        "• `/search_youtube <запрос>` - поиск только на YouTube\n"
         "• `/search_artist <исполнитель>` - поиск по исполнителю\n"
         "• `/search_title <название>` - поиск по названию трека\n"
+        "• `/quality` - качество аудио (low/standard/high)\n"
+        "• `@имя_бота <запрос>` - inline-поиск в любом чате\n"
         "• `/status` - проверка подключений\n"
         "• `/get_vk_token` - инструкция по получению токена VK\n"
         "• `/help` - это сообщение\n\n"
-        "*Важно:* Скачивание из VK временно не работает, но поиск доступен!\n\n"
         "*Примеры:*\n"
         "• `/search Би-2 Полковник`\n"
         "• `/search_vk Мальчик на драйве`\n"
@@ -509,6 +1899,7 @@ def send_welcome(message):
 
 # Команда для получения инструкции по токену VK
 @bot.message_handler(commands=['get_vk_token', 'token'])
+@trace_update('command')
 def handle_get_token(message):
     """Инструкция по получению токена VK"""
     token_instructions = (
@@ -533,6 +1924,7 @@ def handle_get_token(message):
 
 
 @bot.message_handler(commands=['search'])
+@trace_update('search')
 def handle_search_all(message):
     query = message.text.replace('/search', '').strip()
 
@@ -561,6 +1953,7 @@ def handle_search_all(message):
 
 
 @bot.message_handler(commands=['search_yandex'])
+@trace_update('search')
 def handle_search_yandex(message):
     if not ym_client:
         bot.reply_to(message, "❌ Клиент Яндекс.Музыки не настроен. Укажите YANDEX_MUSIC_TOKEN в .env")
@@ -593,6 +1986,7 @@ def handle_search_yandex(message):
 
 
 @bot.message_handler(commands=['search_vk'])
+@trace_update('search')
 def handle_search_vk(message):
     if not VK_MANUAL_TOKEN:
         bot.reply_to(message,
@@ -640,7 +2034,37 @@ def handle_search_vk(message):
                           reply_markup=keyboard)
 
 
+@bot.message_handler(commands=['search_youtube'])
+@trace_update('search')
+def handle_search_youtube(message):
+    query = message.text.replace('/search_youtube', '').strip()
+
+    if not query:
+        bot.reply_to(message, "📝 Использование: `/search_youtube <запрос>`", parse_mode='Markdown')
+        return
+
+    wait_msg = bot.reply_to(message, f"🎬 Ищу '{query}' на YouTube...")
+
+    results = unified_search(query, source="youtube", limit=15)
+
+    if not results:
+        bot.edit_message_text(f"❌ По запросу '{query}' ничего не найдено.",
+                              chat_id=message.chat.id,
+                              message_id=wait_msg.message_id)
+        return
+
+    message_text = show_search_results(message.chat.id, query, results, page=0)
+    keyboard = create_search_keyboard(results, page=0)
+
+    bot.edit_message_text(message_text,
+                          chat_id=message.chat.id,
+                          message_id=wait_msg.message_id,
+                          parse_mode='Markdown',
+                          reply_markup=keyboard)
+
+
 @bot.message_handler(commands=['search_artist'])
+@trace_update('search')
 def handle_search_artist(message):
     if not ym_client:
         bot.reply_to(message, "❌ Клиент Яндекс.Музыки не настроен.")
@@ -673,6 +2097,7 @@ def handle_search_artist(message):
 
 
 @bot.message_handler(commands=['search_title'])
+@trace_update('search')
 def handle_search_title(message):
     if not ym_client:
         bot.reply_to(message, "❌ Клиент Яндекс.Музыки не настроен.")
@@ -704,7 +2129,257 @@ def handle_search_title(message):
                           reply_markup=keyboard)
 
 
+def create_quality_keyboard(current):
+    """Создает инлайн-клавиатуру выбора качества"""
+    markup = types.InlineKeyboardMarkup(row_width=3)
+    buttons = []
+    for tier in QUALITY_ORDER:
+        label = QUALITY_TIERS[tier]['label']
+        if tier == current:
+            label = f"✅ {label}"
+        buttons.append(types.InlineKeyboardButton(label, callback_data=f"quality_{tier}"))
+    markup.add(*buttons)
+    return markup
+
+
+@bot.message_handler(commands=['quality'])
+@trace_update('command')
+def handle_quality(message):
+    """Показывает или меняет качество скачиваемых треков"""
+    chat_id = message.chat.id
+    requested = message.text.replace('/quality', '').strip().lower()
+
+    if requested:
+        if requested not in QUALITY_TIERS:
+            bot.reply_to(message, "📝 Использование: `/quality low|standard|high`", parse_mode='Markdown')
+            return
+        user_quality[chat_id] = requested
+
+    text = f"🎚 *Качество аудио:* {QUALITY_TIERS[get_chat_quality(chat_id)]['label']}\n\n"
+    if FORCE_LOW_QUALITY:
+        text += "⚠️ Сейчас включён режим экономии трафика — все треки отправляются в низком качестве.\n\n"
+    text += "Выберите качество:"
+
+    bot.reply_to(message, text, parse_mode='Markdown',
+                 reply_markup=create_quality_keyboard(user_quality.get(chat_id, DEFAULT_QUALITY)))
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('quality_'))
+@trace_update('callback')
+def handle_quality_callback(call):
+    """Сохраняет выбранное качество"""
+    chat_id = call.message.chat.id
+    tier = call.data.replace('quality_', '')
+    if tier not in QUALITY_TIERS:
+        bot.answer_callback_query(call.id, "❌ Неизвестное качество")
+        return
+
+    user_quality[chat_id] = tier
+    bot.answer_callback_query(call.id, f"Качество: {QUALITY_TIERS[tier]['label']}")
+
+    text = f"🎚 *Качество аудио:* {QUALITY_TIERS[get_chat_quality(chat_id)]['label']}\n\n"
+    if FORCE_LOW_QUALITY:
+        text += "⚠️ Сейчас включён режим экономии трафика — все треки отправляются в низком качестве.\n\n"
+    text += "Выберите качество:"
+
+    bot.edit_message_text(text,
+                          chat_id=chat_id,
+                          message_id=call.message.message_id,
+                          parse_mode='Markdown',
+                          reply_markup=create_quality_keyboard(tier))
+
+
+# --- Диагностика для администратора ---
+# Команды /debug_* работают только в чатах из ADMIN_CHAT_ID и показывают состояние живого процесса
+# (в многопроцессном режиме — того воркера, которому достался чат администратора).
+ADMIN_CHAT_IDS = {int(chat_id) for chat_id in os.environ.get('ADMIN_CHAT_ID', '').replace(' ', '').split(',') if chat_id}
+DEBUG_PROFILE_MAX_SEC = int(os.environ.get('DEBUG_PROFILE_MAX_SEC', 60))
+DEBUG_PROFILE_INTERVAL_MS = float(os.environ.get('DEBUG_PROFILE_INTERVAL_MS', 10))
+DEBUG_TRACEMALLOC_FRAMES = int(os.environ.get('DEBUG_TRACEMALLOC_FRAMES', 10))
+debug_profile_lock = threading.Lock()
+debug_memory_snapshot = None
+
+
+def is_admin_chat(message):
+    return message.chat.id in ADMIN_CHAT_IDS
+
+
+def send_debug_file(chat_id, text, file_name, caption=None):
+    """Отправляет текстовый отчёт документом"""
+    document = io.BytesIO(text.encode('utf-8'))
+    bot.send_document(chat_id, document, visible_file_name=file_name, caption=caption)
+
+
+def format_thread_dump():
+    """Стеки всех потоков процесса"""
+    names = {thread.ident: thread for thread in threading.enumerate()}
+    lines = [f"pid {os.getpid()}, потоков: {len(names)}", ""]
+    for thread_id, frame in sys._current_frames().items():
+        thread = names.get(thread_id)
+        name = thread.name if thread else "?"
+        daemon = " daemon" if thread and thread.daemon else ""
+        lines.append(f"--- {name} (id {thread_id}{daemon}) ---")
+        lines.extend(line.rstrip() for line in traceback.format_stack(frame))
+        lines.append("")
+    return "\n".join(lines)
+
+
+def sample_stacks(duration_sec, interval_ms):
+    """Сэмплирующий профилировщик: собирает стеки всех потоков в формат folded (для flamegraph.pl/speedscope)"""
+    folded = Counter()
+    own_id = threading.get_ident()
+    names = {}
+    deadline = time.perf_counter() + duration_sec
+    samples = 0
+
+    while time.perf_counter() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            if thread_id not in names:
+                thread = next((t for t in threading.enumerate() if t.ident == thread_id), None)
+                names[thread_id] = thread.name if thread else str(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            stack.append(names[thread_id])
+            folded[";".join(reversed(stack))] += 1
+        samples += 1
+        time.sleep(interval_ms / 1000.0)
+
+    return folded, samples
+
+
+def run_debug_profile(chat_id, duration_sec):
+    try:
+        folded, samples = sample_stacks(duration_sec, DEBUG_PROFILE_INTERVAL_MS)
+        text = "\n".join(f"{stack} {count}" for stack, count in folded.most_common())
+        send_debug_file(chat_id, text or "нет данных", f"profile_{os.getpid()}_{int(time.time())}.folded",
+                        caption=f"🔥 Профиль за {duration_sec} с: {samples} сэмплов, {len(folded)} стеков")
+    except Exception as e:
+        print(f"[Debug] Ошибка профилирования: {e}")
+        bot.send_message(chat_id, f"❌ Ошибка профилирования: {e}")
+    finally:
+        debug_profile_lock.release()
+
+
+def collect_runtime_sizes():
+    """Размеры словарей состояния, кэшей и очередей"""
+    with download_jobs_lock:
+        jobs_count = len(download_jobs)
+    with inline_pending_lock:
+        inline_count = len(inline_pending)
+    with yandex_cache_lock:
+        yandex_sizes = (len(yandex_tracks_cache), len(yandex_download_info_cache), len(yandex_direct_link_cache))
+    with search_cache_lock:
+        search_count = len(search_cache)
+    audio_count = len(audio_file_cache)
+
+    worker_pool = getattr(bot, 'worker_pool', None)
+    tasks_queue = getattr(worker_pool, 'tasks', None)
+    return {
+        'pid': os.getpid(),
+        'threads': threading.active_count(),
+        'user_search_history': len(user_search_history),
+        'user_quality': len(user_quality),
+        'search_cache': search_count,
+        'audio_file_cache': audio_count,
+        'yandex_tracks_cache': yandex_sizes[0],
+        'yandex_download_info_cache': yandex_sizes[1],
+        'yandex_direct_link_cache': yandex_sizes[2],
+        'download_jobs': jobs_count,
+        'inline_pending': inline_count,
+        'dns_cache': len(_dns_cache),
+        'bot_task_queue': tasks_queue.qsize() if tasks_queue is not None else None,
+    }
+
+
+@bot.message_handler(commands=['debug_threads'])
+@trace_update('command')
+def handle_debug_threads(message):
+    """Дамп стеков всех потоков"""
+    if not is_admin_chat(message):
+        return
+    send_debug_file(message.chat.id, format_thread_dump(), f"threads_{os.getpid()}_{int(time.time())}.txt",
+                    caption=f"🧵 Потоков: {threading.active_count()}")
+
+
+@bot.message_handler(commands=['debug_profile'])
+@trace_update('command')
+def handle_debug_profile(message):
+    """/debug_profile [секунд] — сэмплирующий профиль CPU в формате folded stacks"""
+    if not is_admin_chat(message):
+        return
+    argument = message.text.replace('/debug_profile', '').strip()
+    duration_sec = int(argument) if argument.isdigit() else 10
+    duration_sec = max(1, min(duration_sec, DEBUG_PROFILE_MAX_SEC))
+
+    if not debug_profile_lock.acquire(blocking=False):
+        bot.reply_to(message, "⏳ Профилирование уже идёт")
+        return
+    bot.reply_to(message, f"🔥 Профилирую {duration_sec} с (интервал {DEBUG_PROFILE_INTERVAL_MS:g} мс)...")
+    # Сэмплер работает в своём потоке, чтобы не занимать поток обработки обновлений
+    threading.Thread(target=run_debug_profile, args=(message.chat.id, duration_sec),
+                     name="rty-debug-profile", daemon=True).start()
+
+
+@bot.message_handler(commands=['debug_mem'])
+@trace_update('command')
+def handle_debug_mem(message):
+    """/debug_mem [N] — топ-N мест выделения памяти и прирост с прошлого снимка; /debug_mem stop — выключить"""
+    global debug_memory_snapshot
+    if not is_admin_chat(message):
+        return
+    argument = message.text.replace('/debug_mem', '').strip().lower()
+
+    if argument == 'stop':
+        tracemalloc.stop()
+        debug_memory_snapshot = None
+        bot.reply_to(message, "🧠 tracemalloc выключен")
+        return
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(DEBUG_TRACEMALLOC_FRAMES)
+        bot.reply_to(message, "🧠 tracemalloc включён. Повторите /debug_mem позже, чтобы получить снимок.")
+        return
+
+    top_n = int(argument) if argument.isdigit() else 25
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ])
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [f"pid {os.getpid()}: сейчас {current / 1024 / 1024:.1f} МБ, пик {peak / 1024 / 1024:.1f} МБ", "",
+             f"Топ-{top_n} по строкам:"]
+    lines.extend(str(stat) for stat in snapshot.statistics('lineno')[:top_n])
+    if debug_memory_snapshot is not None:
+        lines.extend(["", f"Прирост с прошлого снимка (топ-{top_n}):"])
+        lines.extend(str(stat) for stat in snapshot.compare_to(debug_memory_snapshot, 'lineno')[:top_n])
+    debug_memory_snapshot = snapshot
+
+    send_debug_file(message.chat.id, "\n".join(lines), f"memory_{os.getpid()}_{int(time.time())}.txt",
+                    caption=f"🧠 Память: {current / 1024 / 1024:.1f} МБ")
+
+
+@bot.message_handler(commands=['debug_stats'])
+@trace_update('command')
+def handle_debug_stats(message):
+    """Размеры состояния и кэшей, метрики процесса"""
+    if not is_admin_chat(message):
+        return
+    sizes = collect_runtime_sizes()
+    with bot_stats_lock:
+        stats = dict(bot_stats)
+
+    text = "🩺 *Состояние процесса*\n\n"
+    text += "\n".join(f"• `{name}`: {value}" for name, value in sizes.items())
+    text += "\n\n*Метрики:*\n```\n" + json.dumps(stats, ensure_ascii=False, sort_keys=True, indent=1) + "\n```"
+    bot.reply_to(message, text, parse_mode='Markdown')
+
+
 @bot.message_handler(func=lambda message: message.text == '🎵 Мне понравилось')
+@trace_update('command')
 def handle_liked_button(message):
     bot.reply_to(message, "🎵 *Мне понравилось*\n\n"
                           "Эта функция в разработке.\n"
@@ -713,6 +2388,7 @@ def handle_liked_button(message):
 
 
 @bot.message_handler(func=lambda message: message.text == '🔍 Поиск музыки')
+@trace_update('command')
 def handle_search_button(message):
     bot.reply_to(message,
                  "🔍 *Поиск музыки*\n\n"
@@ -720,6 +2396,7 @@ def handle_search_button(message):
                  "• `/search <запрос>` - поиск везде\n"
                  "• `/search_yandex <запрос>` - только Яндекс\n"
                  "• `/search_vk <запрос>` - только ВК\n"
+                 "• `/search_youtube <запрос>` - только YouTube\n"
                  "• `/search_artist <исполнитель>` - по исполнителю\n"
                  "• `/search_title <название>` - по названию\n"
                  "• `/status` - проверить подключения\n\n"
@@ -728,6 +2405,7 @@ def handle_search_button(message):
 
 
 @bot.message_handler(func=lambda message: message.text == '🎧 ВК музыка')
+@trace_update('command')
 def handle_vk_button(message):
     status = "✅ Активен" if vk_audio else "❌ Не активен"
     bot.reply_to(message,
@@ -742,73 +2420,371 @@ def handle_vk_button(message):
 
 
 @bot.message_handler(func=lambda message: message.text == '📋 Помощь')
+@trace_update('command')
 def handle_help_button(message):
     send_welcome(message)
 
 
 # Обработка ссылок на музыку
-@bot.message_handler(func=lambda m: m.text and any(x in m.text for x in ['music.yandex', 'youtube.com', 'youtu.be']))
+def deliver_link_track(message, wait_msg, source, track_key, quality, status_text, download):
+    """Отправляет трек по ссылке: из кэша file_id или скачивая его как отменяемую задачу"""
+    chat_id = message.chat.id
+    icon, label = SOURCE_LABELS[source]
+    if send_cached_audio(chat_id, source, track_key, quality, f"{icon} {label}"):
+        bot.delete_message(chat_id, wait_msg.message_id)
+        return
+
+    job = start_download_job(chat_id, wait_msg.message_id, status_text)
+    submit_download_job(run_link_download, message, job, wait_msg, source, track_key, quality, download)
+
+
+@trace_update('download')
+def run_link_download(message, job, wait_msg, source, track_key, quality, download):
+    """Задача пула скачиваний: скачивает трек по ссылке и отправляет его"""
+    chat_id = message.chat.id
+    icon, label = SOURCE_LABELS[source]
+    try:
+        audio_path, title, performer, status = download(job)
+    finally:
+        finish_download_job(job)
+
+    try:
+        if status == "success" and audio_path:
+            send_track_audio(chat_id, audio_path, title, performer,
+                             f"{icon} {title} ({label})", source, track_key, quality)
+            bot.delete_message(chat_id, wait_msg.message_id)
+            return
+    except Exception as e:
+        print(f"[Job] Ошибка отправки трека: {e}")
+        status = f"ошибка отправки: {str(e)[:100]}"
+
+    if status == "cancelled":
+        bot.edit_message_text("🚫 Скачивание отменено",
+                              chat_id=chat_id,
+                              message_id=wait_msg.message_id)
+    else:
+        bot.edit_message_text(f"❌ Не удалось скачать трек ({label}): {status}",
+                              chat_id=chat_id,
+                              message_id=wait_msg.message_id)
+
+
+@bot.message_handler(func=lambda m: bool(m.text) and MUSIC_LINK_PREFILTER.search(m.text) is not None)
+@trace_update('link')
 def handle_music_link(message):
     """Обрабатывает прямые ссылки на музыку"""
+    chat_id = message.chat.id
+    resolved = resolve_music_url(message.text.strip())
+
+    # Неподдерживаемые ссылки отклоняются сразу, без обращения к бэкендам
+    if not resolved:
+        bot.reply_to(message, "❌ Формат ссылки не поддерживается.\n\n"
+                              "Поддерживаются: треки, альбомы и плейлисты Яндекс.Музыки, "
+                              "видео YouTube (включая youtu.be, shorts и music.youtube.com) и аудио VK.")
+        return
+
+    source, kind, item_id = resolved
+    if source == 'youtube' and kind == 'playlist':
+        bot.reply_to(message, "⚠️ Плейлисты YouTube не поддерживаются.")
+        return
+    if source == 'yandex' and not ym_client:
+        bot.reply_to(message, "❌ Клиент Яндекс.Музыки не настроен. Укажите YANDEX_MUSIC_TOKEN в .env")
+        return
+
     wait_msg = bot.reply_to(message, "🔗 Анализирую ссылку...")
-    url = message.text.strip()
+    quality = get_chat_quality(chat_id)
 
-    # Упрощенная обработка ссылок
-    if 'music.yandex' in url:
-        import re
-        match = re.search(r'music\.yandex\.\w+/album/(\d+)/track/(\d+)', url)
-        if match:
-            album_id, track_id = match.groups()
-            audio_path, title, performer, status = download_yandex_track_fast(int(track_id), int(album_id))
-            if status == "success" and audio_path:
-                with open(audio_path, 'rb') as audio_file:
-                    bot.send_audio(
-                        chat_id=message.chat.id,
-                        audio=audio_file,
-                        title=title[:64],
-                        performer=performer[:64],
-                        caption=f"🎵 {title} (Яндекс.Музыка)",
-                        timeout=60
-                    )
-                try:
-                    os.remove(audio_path)
-                except:
-                    pass
-                bot.delete_message(message.chat.id, wait_msg.message_id)
-                return
-        bot.edit_message_text(f"❌ Не удалось обработать Яндекс-ссылку",
-                              chat_id=message.chat.id,
-                              message_id=wait_msg.message_id)
-    elif 'youtube.com' in url or 'youtu.be' in url:
-        audio_path, title, performer, status = download_from_youtube_fast(url, is_url=True)
-        if status == "success" and audio_path:
-            with open(audio_path, 'rb') as audio_file:
-                bot.send_audio(
-                    chat_id=message.chat.id,
-                    audio=audio_file,
-                    title=title[:64],
-                    performer=performer[:64],
-                    caption=f"🎵 {title} (YouTube)",
-                    timeout=60
-                )
-            try:
-                os.remove(audio_path)
-            except:
-                pass
-            bot.delete_message(message.chat.id, wait_msg.message_id)
-        else:
-            bot.edit_message_text(f"❌ Ошибка загрузки с YouTube: {status}",
-                                  chat_id=message.chat.id,
+    if source == 'yandex' and kind == 'track':
+        track_id, _, album_id = item_id.partition(':')
+        deliver_link_track(message, wait_msg, 'yandex', track_id, quality, "⏳ Скачиваю трек из Яндекс.Музыки...",
+                           lambda job: download_yandex_track_fast(int(track_id), int(album_id) if album_id else None,
+                                                                  quality=quality, job=job))
+
+    elif source == 'yandex':
+        try:
+            collection_title, tracks = get_yandex_collection(kind, item_id)
+        except Exception as e:
+            print(f"[Yandex] Ошибка загрузки {kind} {item_id}: {e}")
+            collection_title, tracks = None, []
+
+        results = [format_yandex_track(track) for track in tracks]
+        if not results:
+            bot.edit_message_text("❌ Не удалось получить треки по ссылке",
+                                  chat_id=chat_id,
                                   message_id=wait_msg.message_id)
+            return
+
+        for i, result in enumerate(results):
+            result['global_index'] = i + 1
+
+        label = "плейлист" if kind == 'playlist' else "альбом"
+        message_text = show_search_results(chat_id, f"{label}: {collection_title}", results, page=0)
+        bot.edit_message_text(message_text,
+                              chat_id=chat_id,
+                              message_id=wait_msg.message_id,
+                              parse_mode='Markdown',
+                              reply_markup=create_search_keyboard(results, page=0))
+
+    elif source == 'youtube':
+        url = f"https://www.youtube.com/watch?v={item_id}"
+        deliver_link_track(message, wait_msg, 'youtube', item_id, quality, "⏳ Скачиваю аудио с YouTube...",
+                           lambda job: download_from_youtube_fast(url, is_url=True, quality=quality, job=job))
+
+    elif source == 'vk':
+        owner_id, _, track_id = item_id.partition('_')
+        track = get_vk_track(chat_id, owner_id, track_id)
+        if not track:
+            bot.edit_message_text("❌ Трек VK не найден или ссылка недоступна",
+                                  chat_id=chat_id,
+                                  message_id=wait_msg.message_id)
+            return
+        deliver_link_track(message, wait_msg, 'vk', item_id, quality, "⏳ Скачиваю трек из ВК Музыки...",
+                           lambda job: download_vk_track_fast(track, quality=quality, job=job))
+
+
+# --- Inline-режим (@bot <запрос>) ---
+INLINE_PAGE_SIZE = 10
+INLINE_SEARCH_LIMIT = int(os.environ.get('INLINE_SEARCH_LIMIT', 20))
+INLINE_CACHE_TIME = int(os.environ.get('INLINE_CACHE_TIME', 300))
+INLINE_DEBOUNCE_MS = int(os.environ.get('INLINE_DEBOUNCE_MS', 700))
+INLINE_MIN_QUERY_LENGTH = 2
+# В inline-сообщение нельзя загрузить новый файл, только подставить file_id, поэтому скачанный трек
+# сначала загружается в этот чат. Без настройки — в личный чат пользователя с ботом (сообщение там удаляется)
+INLINE_UPLOAD_CHAT_ID = os.environ.get('INLINE_UPLOAD_CHAT_ID')
+inline_pending = {}
+inline_pending_lock = threading.Lock()
+
+
+def get_track_link(track):
+    """Возвращает ссылку на трек, которую бот умеет обрабатывать"""
+    if track.get('source') == 'yandex':
+        if not track.get('album_id'):
+            return f"https://music.yandex.ru/track/{track.get('track_id')}"
+        return f"https://music.yandex.ru/album/{track.get('album_id')}/track/{track.get('track_id')}"
+    if track.get('source') == 'vk':
+        return f"https://vk.com/audio{track.get('owner_id')}_{track.get('track_id')}"
+    if track.get('source') == 'youtube':
+        return f"https://www.youtube.com/watch?v={track.get('track_id')}"
+    return track.get('url', '')
+
+
+def build_inline_result(track, quality):
+    """Собирает результат inline-запроса: готовое аудио из кэша или сообщение, которое
+    после выбора заменяется скачанным аудио (см. handle_chosen_inline_result)"""
+    source = track.get('source')
+    if source == 'vk':
+        track_key = f"{track.get('owner_id')}_{track.get('track_id')}"
+        artist = track.get('artist', 'Неизвестный исполнитель')
+    elif source == 'youtube':
+        track_key = str(track.get('track_id'))
+        artist = track.get('artist', 'Неизвестный автор')
     else:
-        bot.edit_message_text(f"❌ Формат ссылки не поддерживается или временно не работает",
-                              chat_id=message.chat.id,
-                              message_id=wait_msg.message_id)
+        track_key = str(track.get('track_id'))
+        artist = track.get('artists', 'Неизвестный исполнитель')
+    result_id = f"{source}:{track_key}"[:64]
+    title = track.get('title', 'Без названия')
+
+    entry, _ = get_cached_audio(source, track_key, quality)
+    if entry:
+        return types.InlineQueryResultCachedAudio(result_id, entry['file_id'])
+
+    # Telegram присылает chosen_inline_result с inline_message_id только для сообщений с клавиатурой
+    # (и при включённом у @BotFather /setinlinefeedback); без этого сообщение так и останется ссылкой
+    source_icon = SOURCE_LABELS.get(source, ("🎧", ""))[0]
+    link = get_track_link(track)
+    keyboard = types.InlineKeyboardMarkup()
+    keyboard.add(types.InlineKeyboardButton(f"{source_icon} Открыть трек", url=link))
+    return types.InlineQueryResultArticle(
+        result_id,
+        f"{source_icon} {title}",
+        types.InputTextMessageContent(f"⏳ Загружаю: {artist} — {title}\n{link}"),
+        reply_markup=keyboard,
+        description=f"{artist} • {track.get('duration', '0:00')}"
+    )
+
+
+@trace_update('inline')
+def answer_inline_search(inline_query):
+    """Выполняет поиск и отвечает на inline-запрос"""
+    text = inline_query.query.strip()
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    quality = get_chat_quality(inline_query.from_user.id)
+
+    results = unified_search(text, source="all", limit=INLINE_SEARCH_LIMIT)
+    page_results = results[offset:offset + INLINE_PAGE_SIZE]
+    next_offset = str(offset + INLINE_PAGE_SIZE) if offset + INLINE_PAGE_SIZE < len(results) else ''
+
+    try:
+        bot.answer_inline_query(inline_query.id,
+                                [build_inline_result(track, quality) for track in page_results],
+                                cache_time=INLINE_CACHE_TIME,
+                                # Ответ зависит от качества пользователя (готовый file_id или ссылка)
+                                is_personal=True,
+                                next_offset=next_offset)
+    except Exception as e:
+        # Запрос мог устареть, пока шёл поиск
+        print(f"[Inline] Не удалось ответить на запрос '{text}': {e}")
+
+
+@bot.inline_handler(func=lambda inline_query: True)
+def handle_inline_query(inline_query):
+    """Inline-поиск с задержкой: пока пользователь печатает, поиск по каждой букве не запускается"""
+    text = inline_query.query.strip()
+    user_id = inline_query.from_user.id
+
+    if len(text) < INLINE_MIN_QUERY_LENGTH:
+        bot.answer_inline_query(inline_query.id, [], cache_time=INLINE_CACHE_TIME)
+        return
+
+    # Следующие страницы и уже закэшированные запросы отвечаем сразу
+    if inline_query.offset or is_search_cached(text, source="all", limit=INLINE_SEARCH_LIMIT):
+        answer_inline_search(inline_query)
+        return
+
+    def run_search():
+        with inline_pending_lock:
+            if inline_pending.get(user_id) is timer:
+                del inline_pending[user_id]
+        answer_inline_search(inline_query)
+
+    timer = threading.Timer(INLINE_DEBOUNCE_MS / 1000.0, run_search)
+    timer.daemon = True
+    with inline_pending_lock:
+        previous = inline_pending.get(user_id)
+        if previous:
+            previous.cancel()
+        inline_pending[user_id] = timer
+    timer.start()
+
+
+@bot.chosen_inline_handler(func=lambda result: True)
+@trace_update('inline')
+def handle_chosen_inline_result(chosen):
+    """Ставит в пул скачивание трека, выбранного в inline-режиме без готового file_id"""
+    if not chosen.inline_message_id:
+        return
+
+    source, _, track_key = chosen.result_id.partition(':')
+    user_id = chosen.from_user.id
+    quality = get_chat_quality(user_id)
+
+    if source == 'yandex':
+        def download(job):
+            return download_yandex_track_fast(int(track_key), quality=quality, job=job)
+    elif source == 'youtube':
+        def download(job):
+            return download_from_youtube_fast(f"https://www.youtube.com/watch?v={track_key}", is_url=True,
+                                              quality=quality, job=job)
+    elif source == 'vk':
+        def download(job):
+            owner_id, _, track_id = track_key.partition('_')
+            track = get_vk_track(user_id, owner_id, track_id)
+            if not track:
+                return None, None, None, "трек VK не найден"
+            return download_vk_track_fast(track, quality=quality, job=job)
+    else:
+        return
+
+    submit_download_job(run_inline_download, chosen, source, track_key, quality, download)
+
+
+@trace_update('download')
+def run_inline_download(chosen, source, track_key, quality, download):
+    """Задача пула скачиваний: скачивает выбранный inline-трек и подставляет его в сообщение"""
+    icon, label = SOURCE_LABELS[source]
+    status = "нет файла"
+    try:
+        # Пока трек ждал в очереди, его мог загрузить кто-то другой
+        entry, _ = get_cached_audio(source, track_key, quality)
+        if not entry:
+            audio_path, title, performer, status = download(None)
+            if status == "success" and audio_path:
+                sent = send_track_audio(INLINE_UPLOAD_CHAT_ID or chosen.from_user.id, audio_path, title, performer,
+                                        f"{icon} {title} ({label})", source, track_key, quality)
+                entry = {'file_id': sent.audio.file_id}
+                if not INLINE_UPLOAD_CHAT_ID:
+                    bot.delete_message(sent.chat.id, sent.message_id)
+
+        if entry:
+            bot.edit_message_media(types.InputMediaAudio(entry['file_id'], caption=f"{icon} {label}"),
+                                   inline_message_id=chosen.inline_message_id)
+            return
+    except Exception as e:
+        print(f"[Inline] Не удалось подставить трек {source}:{track_key}: {e}")
+        status = f"ошибка отправки: {str(e)[:100]}"
+
+    bot.edit_message_text(f"❌ Не удалось скачать трек ({label}): {status}",
+                          inline_message_id=chosen.inline_message_id)
+
+
+def restore_search_message(chat_id, message_id, page, header):
+    """Возвращает сообщение с результатами поиска после скачивания трека"""
+    if chat_id in user_search_history:
+        history = user_search_history[chat_id]
+        query = history['query']
+        results = history['results']
+
+        message_text = show_search_results(chat_id, query, results, page=page)
+        keyboard = create_search_keyboard(results, page=page)
+
+        bot.edit_message_text(f"{header}\n\n" + message_text,
+                              chat_id=chat_id,
+                              message_id=message_id,
+                              parse_mode='Markdown',
+                              reply_markup=keyboard)
+    else:
+        bot.edit_message_text(header,
+                              chat_id=chat_id,
+                              message_id=message_id)
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('cancel_'))
+@trace_update('callback')
+def handle_cancel_callback(call):
+    """Отменяет задачу скачивания"""
+    job_id = call.data.replace('cancel_', '')
+    with download_jobs_lock:
+        job = download_jobs.get(job_id)
+
+    if not job or job['chat_id'] != call.message.chat.id:
+        bot.answer_callback_query(call.id, "Задача уже завершена")
+        return
+
+    job['cancel'].set()
+    bot.answer_callback_query(call.id, "🚫 Отменяю скачивание...")
+
+
+@trace_update('download')
+def run_search_download(call, job, source, track_key, quality, page, download):
+    """Задача пула скачиваний: скачивает трек из результатов поиска и возвращает список результатов"""
+    chat_id = call.message.chat.id
+    icon, label = SOURCE_LABELS[source]
+    try:
+        audio_path, title, performer, status = download(job)
+    finally:
+        finish_download_job(job)
+
+    try:
+        if audio_path and os.path.exists(audio_path):
+            send_track_audio(chat_id, audio_path, title, performer,
+                             f"{icon} {title} ({label})", source, track_key, quality)
+            restore_search_message(chat_id, call.message.message_id, page, f"✅ Трек '{title}' скачан!")
+            return
+    except Exception as e:
+        print(f"[Job] Ошибка отправки трека: {e}")
+        status = f"ошибка отправки: {str(e)[:100]}"
+
+    if status == "cancelled":
+        restore_search_message(chat_id, call.message.message_id, page, "🚫 Скачивание отменено")
+    else:
+        bot.edit_message_text(f"❌ Ошибка скачивания: {status}",
+                              chat_id=chat_id,
+                              message_id=call.message.message_id)
 
 
 # Обработка inline-кнопок
 @bot.callback_query_handler(
     func=lambda call: call.data.startswith(('dl_', 'page_', 'filter_', 'new_search', 'info_vk')))
+@trace_update('callback')
 def handle_search_callback(call):
     """Обрабатывает все callback-запросы от поиска"""
     try:
@@ -820,6 +2796,7 @@ def handle_search_callback(call):
                                   "• `/search <запрос>` - поиск везде\n"
                                   "• `/search_yandex <запрос>` - только Яндекс\n"
                                   "• `/search_vk <запрос>` - только ВК\n"
+                                  "• `/search_youtube <запрос>` - только YouTube\n"
                                   "• `/search_artist <исполнитель>` - по исполнителю\n"
                                   "• `/search_title <название>` - по названию",
                                   chat_id=chat_id,
@@ -842,6 +2819,8 @@ def handle_search_callback(call):
                 filtered_results = [r for r in all_results if r.get('source') == 'yandex']
             elif filter_type == 'vk':
                 filtered_results = [r for r in all_results if r.get('source') == 'vk']
+            elif filter_type == 'youtube':
+                filtered_results = [r for r in all_results if r.get('source') == 'youtube']
             else:
                 filtered_results = all_results
 
@@ -893,83 +2872,62 @@ def handle_search_callback(call):
             track_id = int(parts[2])
             album_id = int(parts[3])
             page = int(parts[4]) if len(parts) > 4 else 0
+            quality = get_chat_quality(chat_id)
+
+            if send_cached_audio(chat_id, 'yandex', track_id, quality, "🎵 Яндекс.Музыка"):
+                bot.answer_callback_query(call.id, "✅ Отправлено из кэша")
+                return
 
             bot.answer_callback_query(call.id, "⏳ Скачиваю...")
-            bot.edit_message_text("⏳ Скачиваю трек из Яндекс.Музыки...",
-                                  chat_id=chat_id,
-                                  message_id=call.message.message_id)
+            job = start_download_job(chat_id, call.message.message_id, "⏳ Скачиваю трек из Яндекс.Музыки...")
+            submit_download_job(run_search_download, call, job, 'yandex', track_id, quality, page,
+                                lambda job: download_yandex_track_fast(track_id, album_id, quality=quality, job=job))
+
+        elif call.data.startswith('dl_yt_'):
+            # В id видео бывает «_», поэтому номер страницы отделяется справа
+            video_id, _, page = call.data[len('dl_yt_'):].rpartition('_')
+            page = int(page) if page.isdigit() else 0
+            quality = get_chat_quality(chat_id)
+
+            if send_cached_audio(chat_id, 'youtube', video_id, quality, "🎬 YouTube"):
+                bot.answer_callback_query(call.id, "✅ Отправлено из кэша")
+                return
 
-            audio_path, title, performer, status = download_yandex_track_fast(track_id, album_id)
+            bot.answer_callback_query(call.id, "⏳ Скачиваю...")
+            job = start_download_job(chat_id, call.message.message_id, "⏳ Скачиваю аудио с YouTube...")
+            video_url = f"https://www.youtube.com/watch?v={video_id}"
+            submit_download_job(run_search_download, call, job, 'youtube', video_id, quality, page,
+                                lambda job: download_from_youtube_fast(video_url, is_url=True,
+                                                                       quality=quality, job=job))
 
-            if audio_path and os.path.exists(audio_path):
-                with open(audio_path, 'rb') as audio_file:
-                    bot.send_audio(
-                        chat_id=chat_id,
-                        audio=audio_file,
-                        title=title[:64] if title else "Трек",
-                        performer=performer[:64] if performer else None,
-                        caption=f"🎵 {title} (Яндекс.Музыка)",
-                        timeout=60
-                    )
+        elif call.data.startswith(('dl_vk', 'info_vk')):
+            parts = call.data.split('_')
+            if call.data.startswith('dl_vk'):
+                owner_id, track_id = parts[2], parts[3]
+                page = int(parts[4]) if len(parts) > 4 else 0
+            else:
+                # Кнопки старого формата: info_vk_<track_id>_<owner_id>_<url>_<page>
+                track_id, owner_id = parts[2], parts[3]
+                page = int(parts[-1]) if parts[-1].isdigit() else 0
+            vk_key = f"{owner_id}_{track_id}"
+            quality = get_chat_quality(chat_id)
+
+            if send_cached_audio(chat_id, 'vk', vk_key, quality, "🎧 ВК Музыка"):
+                bot.answer_callback_query(call.id, "✅ Отправлено из кэша")
+                return
 
-                try:
-                    os.remove(audio_path)
-                except:
-                    pass
+            bot.answer_callback_query(call.id, "⏳ Скачиваю...")
 
-                if chat_id in user_search_history:
-                    history = user_search_history[chat_id]
-                    query = history['query']
-                    results = history['results']
-
-                    message_text = show_search_results(chat_id, query, results, page=page)
-                    keyboard = create_search_keyboard(results, page=page)
-
-                    bot.edit_message_text(f"✅ Трек '{title}' скачан!\n\n" + message_text,
-                                          chat_id=chat_id,
-                                          message_id=call.message.message_id,
-                                          parse_mode='Markdown',
-                                          reply_markup=keyboard)
-                else:
-                    bot.edit_message_text(f"✅ Трек '{title}' успешно скачан!",
-                                          chat_id=chat_id,
-                                          message_id=call.message.message_id)
-            else:
-                bot.edit_message_text(f"❌ Ошибка скачивания: {status}",
+            track = get_vk_track(chat_id, owner_id, track_id)
+            if not track:
+                bot.edit_message_text("❌ Трек VK не найден или ссылка недоступна",
                                       chat_id=chat_id,
                                       message_id=call.message.message_id)
+                return
 
-        elif call.data.startswith('info_vk'):
-            parts = call.data.split('_')
-            if len(parts) >= 6:
-                track_id = parts[2]
-                owner_id = parts[3]
-                url_encoded = parts[4]
-                page = parts[5] if len(parts) > 5 else 0
-
-                # Декодируем URL
-                url = unquote(url_encoded) if url_encoded else ""
-
-                bot.answer_callback_query(call.id, "ℹ️  Информация о треке VK")
-
-                info_text = (
-                    f"🎧 *Трек из VK*\n\n"
-                    f"Скачивание треков из VK через бота временно не работает.\n"
-                    f"Вы можете прослушать этот трек по ссылке:\n\n"
-                )
-
-                if url:
-                    info_text += f"[Ссылка для прослушивания]({url})\n\n"
-
-                info_text += (
-                    f"*ID трека:* `{track_id}`\n"
-                    f"*ID владельца:* `{owner_id}`\n\n"
-                    f"_Ссылка действительна ограниченное время_"
-                )
-
-                bot.send_message(chat_id, info_text, parse_mode='Markdown',
-                                 disable_web_page_preview=False if url else True)
-            return
+            job = start_download_job(chat_id, call.message.message_id, "⏳ Скачиваю трек из ВК Музыки...")
+            submit_download_job(run_search_download, call, job, 'vk', vk_key, quality, page,
+                                lambda job: download_vk_track_fast(track, quality=quality, job=job))
 
     except Exception as e:
         print(f"[!] Ошибка обработки callback: {e}")
@@ -979,6 +2937,167 @@ def handle_search_callback(call):
             pass
 
 
+# --- 8. МНОГОПРОЦЕССНЫЙ РЕЖИМ ---
+# Супервизор сам получает обновления и раздаёт их воркерам по хэшу chat_id,
+# поэтому состояние чата (user_search_history, user_quality) живёт в одном процессе.
+BOT_WORKERS = int(os.environ.get('BOT_WORKERS', 1))
+WORKER_THREADS = int(os.environ.get('WORKER_THREADS', 4))
+WORKER_QUEUE_SIZE = int(os.environ.get('WORKER_QUEUE_SIZE', 1000))
+STATS_REPORT_INTERVAL = int(os.environ.get('STATS_REPORT_INTERVAL', 300))
+STATS_FLUSH_INTERVAL = int(os.environ.get('STATS_FLUSH_INTERVAL', 10))
+
+
+def get_update_chat_id(raw_update):
+    """Определяет chat_id (или id пользователя для inline-запросов) по «сырому» обновлению"""
+    for key in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        if key in raw_update:
+            return raw_update[key]['chat']['id']
+
+    for key in ('callback_query', 'inline_query', 'chosen_inline_result'):
+        if key in raw_update:
+            payload = raw_update[key]
+            message = payload.get('message')
+            if message:
+                return message['chat']['id']
+            return payload['from']['id']
+
+    return raw_update.get('update_id', 0)
+
+
+def flush_worker_stats(index, shared_stats):
+    """Периодически отдаёт супервизору снимок локальных метрик воркера"""
+    while True:
+        time.sleep(STATS_FLUSH_INTERVAL)
+        with bot_stats_lock:
+            snapshot = dict(bot_stats)
+        try:
+            shared_stats[index] = snapshot
+        except Exception as e:
+            print(f"[Worker {index}] Не удалось передать метрики: {e}")
+
+
+def worker_main(index, update_queue, shared_cache, shared_cache_lock, shared_stats):
+    """Процесс-воркер: обрабатывает обновления своей доли чатов"""
+    global audio_file_cache, audio_file_cache_lock, TRACE_LOG_PATH
+
+    # Кэш file_id общий для всех воркеров
+    audio_file_cache = shared_cache
+    audio_file_cache_lock = shared_cache_lock
+
+    # Метрики считаются локально (без обращений к менеджеру на каждый bump_stat),
+    # супервизор получает их снимками раз в STATS_FLUSH_INTERVAL
+    with bot_stats_lock:
+        bot_stats.clear()
+    threading.Thread(target=flush_worker_stats, args=(index, shared_stats),
+                     name=f"rty-stats-{index}", daemon=True).start()
+
+    # Сокеты пулов унаследованы от супервизора — открываем свои
+    reset_http_pools()
+
+    # У каждого воркера свой файл трассировок: ротация не пересекается между процессами
+    close_trace_log()
+    if TRACE_LOG_PATH:
+        base, ext = os.path.splitext(TRACE_LOG_PATH)
+        TRACE_LOG_PATH = f"{base}.worker{index}{ext}"
+
+    # Потоки пула telebot не переживают fork — создаём пул заново
+    bot.worker_pool = telebot.util.ThreadPool(bot, num_threads=WORKER_THREADS)
+    print(f"[Worker {index}] Запущен (pid {os.getpid()})")
+
+    # Прогрев идёт в каждом воркере после fork: супервизор модули не импортирует,
+    # поэтому воркер не наследует ни недоимпортированный модуль, ни захваченные блокировки импорта
+    if PRELOAD_BACKENDS:
+        threading.Thread(target=preload_backends, name=f"rty-preload-{index}", daemon=True).start()
+
+    while True:
+        raw_update = update_queue.get()
+        if raw_update is None:
+            break
+        try:
+            bot.process_new_updates([types.Update.de_json(raw_update)])
+        except Exception as e:
+            print(f"[Worker {index}] Ошибка обработки обновления: {e}")
+
+    bot.worker_pool.close()
+    print(f"[Worker {index}] Остановлен")
+
+
+def run_supervisor(workers_count):
+    """Запускает воркеры и раздаёт им обновления из long polling"""
+    # Воркеры наследуют зарегистрированные обработчики и клиентов через fork, которого нет в Windows
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        raise RuntimeError(f"BOT_WORKERS={workers_count} требует fork (Linux/macOS), "
+                           f"на этой платформе запускайте бота с BOT_WORKERS=1")
+
+    ctx = multiprocessing.get_context('fork')
+    manager = ctx.Manager()
+    shared_cache = manager.dict()
+    shared_cache_lock = manager.Lock()
+    # Снимки метрик воркеров: индекс воркера -> словарь счётчиков
+    shared_stats = manager.dict()
+    queues = [ctx.Queue(maxsize=WORKER_QUEUE_SIZE) for _ in range(workers_count)]
+    workers = [None] * workers_count
+
+    def start_worker(index):
+        process = ctx.Process(target=worker_main, name=f"rty-worker-{index}",
+                              args=(index, queues[index], shared_cache, shared_cache_lock, shared_stats),
+                              daemon=True)
+        process.start()
+        workers[index] = process
+
+    for index in range(workers_count):
+        start_worker(index)
+
+    print(f"🧩 Супервизор: {workers_count} воркеров по {WORKER_THREADS} потоков")
+    offset = None
+    last_report = time.time()
+
+    try:
+        while True:
+            for index, process in enumerate(workers):
+                if not process.is_alive():
+                    print(f"[Supervisor] Воркер {index} завершился (код {process.exitcode}), перезапускаю")
+                    start_worker(index)
+
+            try:
+                raw_updates = telebot.apihelper.get_updates(bot.token, offset=offset, timeout=60,
+                                                            long_polling_timeout=60)
+            except Exception as e:
+                print(f"[Supervisor] Ошибка получения обновлений: {e}")
+                time.sleep(3)
+                continue
+
+            for raw_update in raw_updates:
+                offset = raw_update['update_id'] + 1
+                shard = abs(int(get_update_chat_id(raw_update))) % workers_count
+                queues[shard].put(raw_update)
+
+            if time.time() - last_report >= STATS_REPORT_INTERVAL:
+                last_report = time.time()
+                snapshot = {}
+                for worker_stats in shared_stats.values():
+                    for name, value in worker_stats.items():
+                        snapshot[name] = snapshot.get(name, 0) + value
+                print(f"[Supervisor] Метрики: {json.dumps(snapshot, ensure_ascii=False, sort_keys=True)}")
+    finally:
+        for update_queue in queues:
+            update_queue.put(None)
+        for process in workers:
+            process.join(timeout=10)
+        manager.shutdown()
+
+
+def preload_backends():
+    """Прогревает модули из PRELOAD_BACKENDS в фоне, не задерживая начало приёма обновлений"""
+    modules = {'youtube': ['yt_dlp'], 'yandex': ['yandex_music'], 'vk': ['vk_api', 'vk_api.audio']}
+    for backend in PRELOAD_BACKENDS:
+        for module_name in modules.get(backend, []):
+            try:
+                load_backend_module(backend, module_name)
+            except ImportError as e:
+                print(f"[Startup] Не удалось загрузить {module_name}: {e}")
+
+
 # --- ЗАПУСК БОТА ---
 if __name__ == '__main__':
     print("=" * 60)
@@ -1002,7 +3121,17 @@ if __name__ == '__main__':
         if VK_MANUAL_TOKEN:
             print("   Токен указан, но клиент не инициализирован. Проверьте токен.")
 
-    print("🎬 YouTube: Модуль активен")
+    print("🎬 YouTube: Модуль активен (yt-dlp загружается при первом обращении)")
+    if FORCE_LOW_QUALITY:
+        print("🎚 Качество: принудительно низкое (FORCE_LOW_QUALITY)")
+    else:
+        print(f"🎚 Качество по умолчанию: {DEFAULT_QUALITY}")
+    if TELEGRAM_API_URL:
+        upload_mode = "файлы по пути" if TELEGRAM_LOCAL_FILES else "multipart"
+        print(f"📡 Bot API: {TELEGRAM_API_URL} ({upload_mode}, до {MAX_FILE_MB} МБ)")
+    print("=" * 60)
+    print("⏱  Время запуска по бэкендам:")
+    print(format_startup_report())
     print("=" * 60)
     print("ℹ️  Используйте команды в боте:")
     print("   /status - проверка подключений")
@@ -1010,8 +3139,14 @@ if __name__ == '__main__':
     print("   /search_vk тест - проверить поиск в VK")
     print("=" * 60)
 
+    if PRELOAD_BACKENDS and BOT_WORKERS <= 1:
+        threading.Thread(target=preload_backends, name="rty-preload", daemon=True).start()
+
     try:
-        bot.infinity_polling(timeout=120, long_polling_timeout=60)
+        if BOT_WORKERS > 1:
+            run_supervisor(BOT_WORKERS)
+        else:
+            bot.infinity_polling(timeout=120, long_polling_timeout=60)
     except Exception as e:
         print(f"❌ Критическая ошибка бота: {e}")
         print("Проверьте токены в .env файле и перезапустите бота.")
\ No newline at end of file